@@ -1,26 +1,52 @@
 from datetime import datetime, timedelta, timezone
 
-from fastapi import HTTPException, Request, status
-from passlib.context import CryptContext
+from fastapi import HTTPException, status
 from pydantic import EmailStr
-from jose import JWTError, jwt
+from jose import jwt
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from .dao import UserDAO
 from .config import settings
+from .hashing import HashQueueFull, password_hasher
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token') 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def hashing_overloaded():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервис перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def verify_password(plain_password, hashed_password):
+    verified, _ = await verify_and_update_password(plain_password, hashed_password)
+    return verified
+
+
+async def verify_and_update_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HashQueueFull:
+        raise hashing_overloaded()
+
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashQueueFull:
+        raise hashing_overloaded()
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hashes(passwords):
+    try:
+        return await password_hasher.hash_many(passwords)
+    except HashQueueFull:
+        raise hashing_overloaded()
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -34,33 +60,16 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def authenticate_user(email: EmailStr, password: str):
-    user = await UserDAO.find_one_or_none(email=email)
+async def authenticate_user(session: AsyncSession, email: EmailStr, password: str):
+    user = await UserDAO.find_credentials(session, email)
     if not user:
         return None 
-    if not verify_password(password, user.password):
+    # Завершаем транзакцию, чтобы не держать соединение из пула на время bcrypt
+    await session.commit()
+    verified, new_hash = await verify_and_update_password(password, user.password)
+    if not verified:
         return None
+    if new_hash:
+        # Стоимость bcrypt изменилась — перехешируем пароль при входе
+        await UserDAO.update(session, user.id, password=new_hash)
     return user
-
-async def get_current_user(request: Request):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    token = request.cookies.get('user_access_token')
-    if not token:
-        raise credentials_exception
-
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = await UserDAO.find_one_or_none(id=int(user_id))
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
@@ -0,0 +1,170 @@
+import json
+import time
+from collections import OrderedDict
+
+from .config import settings
+
+
+MISSING = object()
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as exc:
+            raise RuntimeError("Для работы с Redis установите пакет redis") from exc
+        _redis = aioredis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+        )
+    return _redis
+
+
+class MemoryCache:
+
+    def __init__(self, namespace: str, ttl: int, maxsize: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_many(self, keys: list[str]) -> dict:
+        return {key: await self.get(key) for key in keys}
+
+    async def set_many(self, items: list[tuple[str, object, int | None]]):
+        for key, value, ttl in items:
+            await self.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def delete_prefix(self, prefix: str):
+        for key in [key for key in self._data if key.startswith(prefix)]:
+            del self._data[key]
+
+    async def clear(self):
+        self._data.clear()
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "namespace": self.namespace,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RedisCache:
+    # Ограничение размера и LRU-вытеснение в Redis задаются на стороне сервера
+    # (maxmemory + maxmemory-policy allkeys-lru), evictions берём из INFO.
+
+    def __init__(self, namespace: str, ttl: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str):
+        raw = await get_redis().get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        await get_redis().set(self._key(key), json.dumps(value), ex=ttl)
+
+    async def get_many(self, keys: list[str]) -> dict:
+        if not keys:
+            return {}
+        raws = await get_redis().mget([self._key(key) for key in keys])
+        result = {}
+        for key, raw in zip(keys, raws):
+            if raw is None:
+                self.misses += 1
+                result[key] = MISSING
+            else:
+                self.hits += 1
+                result[key] = json.loads(raw)
+        return result
+
+    async def set_many(self, items: list[tuple[str, object, int | None]]):
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for key, value, ttl in items:
+                pipe.set(self._key(key), json.dumps(value), ex=self.ttl if ttl is None else ttl)
+            await pipe.execute()
+
+    async def delete(self, *keys: str):
+        if keys:
+            await get_redis().delete(*(self._key(key) for key in keys))
+
+    async def delete_prefix(self, prefix: str):
+        redis = get_redis()
+        keys = [key async for key in redis.scan_iter(match=f"{self._key(prefix)}*")]
+        if keys:
+            await redis.delete(*keys)
+
+    async def clear(self):
+        await self.delete_prefix("")
+
+    async def stats(self) -> dict:
+        info = await get_redis().info("stats")
+        return {
+            "backend": "redis",
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": info.get("evicted_keys", 0),
+        }
+
+
+caches: dict[str, MemoryCache | RedisCache] = {}
+
+
+def build_cache(namespace: str, ttl: int | None = None, maxsize: int | None = None):
+    ttl = settings.CACHE_TTL if ttl is None else ttl
+    if settings.CACHE_BACKEND == "redis":
+        cache = RedisCache(namespace, ttl)
+    else:
+        cache = MemoryCache(namespace, ttl, maxsize or settings.CACHE_MAXSIZE)
+    caches[namespace] = cache
+    return cache
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from sqlalchemy import String, column, func, select, table, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .config import settings
+from .database import engine
+from .hashing import _hash
+from .models import User
+from .outbox import referral_event_cte
+from referral_code.models import ReferralLink
+from referral_code.stats import reconcile, referral_counter_ctes
+from referral_code.sweeper import sweeper
+
+
+USERS_STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS users_import (
+    email varchar(255),
+    password varchar(255),
+    referral_code varchar(255)
+)
+"""
+
+users_import = table(
+    "users_import", column("email", String), column("password", String), column("referral_code", String)
+)
+
+
+def users_merge():
+    # Слияние пачки из users_import теми же CTE счётчиков и событий, что и регистрация через API.
+    # Строится на каждую пачку: день в счётчиках — дата запроса
+    staged = users_import.outerjoin(ReferralLink, ReferralLink.code == users_import.c.referral_code)
+    inserted = (
+        pg_insert(User)
+        .from_select(
+            ["email", "password", "code_id"],
+            select(users_import.c.email, users_import.c.password, ReferralLink.id).select_from(staged),
+        )
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User.id, User.email, User.code_id)
+        .cte("inserted")
+    )
+    unresolved = (
+        select(func.count())
+        .select_from(staged)
+        .where(users_import.c.referral_code.is_not(None) & ReferralLink.id.is_(None))
+        .scalar_subquery()
+    )
+    return select(
+        select(func.count()).select_from(inserted).scalar_subquery().label("inserted"),
+        unresolved.label("unresolved_codes"),
+    ).add_cte(*referral_counter_ctes(inserted), referral_event_cte(inserted))
+
+
+CODES_STAGING = """
+CREATE TEMP TABLE IF NOT EXISTS codes_import (
+    code varchar(255),
+    expiration_date timestamp
+)
+"""
+
+CODES_MERGE = """
+INSERT INTO referral_link (code, expiration_date)
+SELECT code, expiration_date FROM codes_import
+ON CONFLICT (code) DO NOTHING
+"""
+
+EXPORTS = {
+    "users": """
+        SELECT u.id, u.email, u.password, r.code AS referral_code
+        FROM users u LEFT JOIN referral_link r ON r.id = u.code_id
+        ORDER BY u.id
+    """,
+    "codes": "SELECT id, code, expiration_date FROM referral_link ORDER BY id",
+}
+
+
+def detect_format(path: str, file_format: str | None) -> str:
+    if file_format:
+        return file_format
+    return "ndjson" if Path(path).suffix in (".ndjson", ".jsonl") else "csv"
+
+
+def read_rows(stream, file_format: str):
+    if file_format == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batched(rows, size: int):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+async def driver_connection(conn):
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def hash_passwords(pool: ProcessPoolExecutor, passwords: list[str]) -> list[str]:
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(pool, _hash, password, settings.BCRYPT_ROUNDS) for password in passwords
+    ))
+
+
+async def import_users(stream, file_format: str, batch_size: int, plaintext: bool = False, hash_workers: int = 1) -> dict:
+    # Пароли по умолчанию считаются уже захешированными (bcrypt); с plaintext хешируем сами
+    totals = {"read": 0, "inserted": 0, "unresolved_codes": 0}
+    pool = ProcessPoolExecutor(max_workers=hash_workers) if plaintext else None
+    try:
+        async with engine.connect() as conn:
+            pg = await driver_connection(conn)
+            await conn.execute(text(USERS_STAGING))
+            await conn.commit()
+            for batch in batched(read_rows(stream, file_format), batch_size):
+                column = "password" if plaintext else "password_hash"
+                for row in batch:
+                    if not row.get(column):
+                        raise ValueError(f"{row.get('email')}: нет поля {column}")
+                passwords = [row[column] for row in batch]
+                if pool:
+                    passwords = await hash_passwords(pool, passwords)
+                records = [
+                    (row["email"], password, row.get("referral_code") or None)
+                    for row, password in zip(batch, passwords)
+                ]
+                # Транзакцию открывает первый запрос через SQLAlchemy; COPY идёт в ней же
+                async with conn.begin():
+                    await conn.execute(text("TRUNCATE users_import"))
+                    await pg.copy_records_to_table("users_import", records=records)
+                    merged = (await conn.execute(users_merge())).one()
+
+                totals["read"] += len(records)
+                totals["inserted"] += merged.inserted
+                totals["unresolved_codes"] += merged.unresolved_codes
+    finally:
+        if pool:
+            pool.shutdown()
+    return totals
+
+
+async def import_codes(stream, file_format: str, batch_size: int) -> dict:
+    totals = {"read": 0, "inserted": 0}
+    async with engine.connect() as conn:
+        pg = await driver_connection(conn)
+        await pg.execute(CODES_STAGING)
+        for batch in batched(read_rows(stream, file_format), batch_size):
+            records = [(row["code"], datetime.fromisoformat(row["expiration_date"])) for row in batch]
+            async with pg.transaction():
+                await pg.execute("TRUNCATE codes_import")
+                await pg.copy_records_to_table("codes_import", records=records)
+                status = await pg.execute(CODES_MERGE)
+
+            totals["read"] += len(records)
+            totals["inserted"] += int(status.split()[-1])
+    return totals
+
+
+async def export_table(table: str, output, file_format: str, batch_size: int) -> int:
+    query = EXPORTS[table]
+    async with engine.connect() as conn:
+        pg = await driver_connection(conn)
+        if file_format == "csv":
+            status = await pg.copy_from_query(query, output=output, format="csv", header=True)
+            return int(status.split()[-1])
+
+        exported = 0
+        async with pg.transaction():
+            async for record in pg.cursor(query, prefetch=batch_size):
+                line = json.dumps(dict(record), default=str, ensure_ascii=False) + "\n"
+                output.write(line.encode())
+                exported += 1
+        return exported
+
+
+async def run(args) -> dict:
+    started = time.perf_counter()
+
+    if args.command == "reconcile-stats":
+        result = await reconcile(args.batch_size)
+    elif args.command == "sweep-expired":
+        result = await sweeper.sweep(batch_size=args.batch_size)
+    elif args.command == "import":
+        file_format = detect_format(args.file, args.format)
+        with open(args.file, newline="", encoding="utf-8") as stream:
+            if args.table == "users":
+                result = await import_users(stream, file_format, args.batch_size, args.plaintext, args.hash_workers)
+            else:
+                result = await import_codes(stream, file_format, args.batch_size)
+    else:
+        file_format = detect_format(args.file, args.format)
+        if args.file == "-":
+            result = {"exported": await export_table(args.table, sys.stdout.buffer, file_format, args.batch_size)}
+        else:
+            with open(args.file, "wb") as output:
+                result = {"exported": await export_table(args.table, output, file_format, args.batch_size)}
+
+    await engine.dispose()
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Массовый импорт и экспорт пользователей и реферальных кодов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command in ("import", "export"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("table", choices=["users", "codes"])
+        subparser.add_argument("file", help="CSV или NDJSON; для экспорта '-' — stdout")
+        subparser.add_argument("--format", choices=["csv", "ndjson"])
+        subparser.add_argument("--batch-size", type=int, default=10000)
+        if command == "import":
+            subparser.add_argument("--plaintext", action="store_true", help="пароли в открытом виде, хешировать при импорте")
+            subparser.add_argument("--hash-workers", type=int, default=4)
+
+    reconcile_parser = subparsers.add_parser("reconcile-stats", help="пересчитать счётчики рефералов из users.code_id")
+    reconcile_parser.add_argument("--batch-size", type=int, default=1000)
+
+    sweep_parser = subparsers.add_parser("sweep-expired", help="перенести истёкшие коды и их привязки в архив")
+    sweep_parser.add_argument("--batch-size", type=int)
+
+    args = parser.parse_args(argv)
+    try:
+        result = asyncio.run(run(args))
+    except ValueError as exc:
+        parser.exit(1, f"{exc}\n")
+    print(json.dumps(result), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,14 +32,134 @@ class Settings(BaseSettings):
     
     model_config = ConfigDict(env_file=".env")
 
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Сколько соединений открыть при старте (не больше DB_POOL_SIZE)
+    DB_POOL_PREWARM: int = 5
+    WARMUP_ENABLED: bool = True
+
+    DB_REPLICA_URLS: list[str] = []
+    DB_REPLICA_HEALTH_INTERVAL: float = 5.0
+    DB_REPLICA_STICKY_SECONDS: int = 5
+
+    OUTBOX_ENABLED: bool = True
+    OUTBOX_SINK: Literal["file", "webhook", "memory"] = "file"
+    OUTBOX_FILE_PATH: str = "referral_events.ndjson"
+    OUTBOX_WEBHOOK_URL: Optional[str] = None
+    OUTBOX_WEBHOOK_TIMEOUT: float = 5.0
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL: float = 1.0
+    OUTBOX_LEASE_SECONDS: int = 60
+    OUTBOX_BACKOFF_BASE: float = 1.0
+    OUTBOX_BACKOFF_MAX: float = 300.0
+
+    QUERY_PROFILING: bool = False
+    QUERY_BUDGET: int = 10
+    # Бюджеты для отдельных маршрутов: "/referral/delete-link" -> 4
+    QUERY_BUDGETS: dict[str, int] = {}
+    SLOW_QUERY_THRESHOLD: float = 0.1
+    SLOW_QUERY_EXPLAIN: bool = True
+
 
     SECRET_KEY : str
     ALGORITHM : str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    AUTH_CACHE_TTL: int = 30
 
     redis_host: str
     redis_port: int
     redis_db: int
 
+    CACHE_BACKEND: Literal["memory", "redis"] = "memory"
+    CACHE_TTL: int = 60
+    CACHE_MAXSIZE: int = 10000
+    # Число процессов uvicorn (--workers); с памятью отзыв токена при logout не дойдёт до остальных
+    WORKERS: int = 1
+
+    @model_validator(mode="after")
+    def check_shared_state(self):
+        if self.WORKERS > 1 and self.CACHE_BACKEND != "redis":
+            raise ValueError("При WORKERS > 1 нужен CACHE_BACKEND=redis: иначе отозванные токены действуют в других воркерах")
+        return self
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    PASSWORD_HASH_EXECUTOR: Literal["thread", "process"] = "thread"
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 100
+    BCRYPT_ROUNDS: int = 12
+
+    REGISTER_BATCH_MAX_SIZE: int = 1000
+
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "redis"] = "redis"
+    RATE_LIMIT_REDIS_RETRY: float = 30.0
+    RATE_LIMIT_TRUST_FORWARDED: bool = False
+    # "<маршрут>:ip" / "<маршрут>:email" -> "<запросов>/<секунд>"
+    RATE_LIMITS: dict[str, str] = {
+        "login:ip": "60/60",
+        "login:email": "10/60",
+        "token:ip": "60/60",
+        "token:email": "10/60",
+        "register:ip": "30/60",
+        "register:email": "5/60",
+        "register_batch:ip": "1000/3600",
+    }
+
+    REFERRALS_PAGE_SIZE: int = 100
+    REFERRALS_PAGE_MAX_SIZE: int = 1000
+    REFERRALS_STREAM_BATCH_SIZE: int = 1000
+    CODES_BY_EMAIL_MAX_SIZE: int = 5000
+
+    REFERRAL_TREE_MAX_DEPTH: int = 10
+    REFERRAL_TREE_MAX_NODES: int = 10000
+    REFERRAL_TREE_CACHE_TTL: int = 300
+
+    CODE_LENGTH: int = 20
+    CODE_ALPHABET: str = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    CODE_CLAIM_ATTEMPTS: int = 3
+    CODE_POOL_ENABLED: bool = True
+    CODE_POOL_TARGET_SIZE: int = 1000
+    CODE_POOL_LOW_WATERMARK: int = 200
+    CODE_POOL_REFILL_BATCH: int = 500
+    CODE_POOL_REFILL_INTERVAL: float = 5.0
+
+    CODE_FILTER_ENABLED: bool = True
+    CODE_FILTER_CAPACITY: int = 1_000_000
+    CODE_FILTER_ERROR_RATE: float = 0.01
+    CODE_FILTER_BATCH_SIZE: int = 10000
+    CODE_FILTER_REFRESH_INTERVAL: float = 5.0
+    CODE_FILTER_REFRESH_OVERLAP: int = 1000
+    CODE_FILTER_REBUILD_INTERVAL: float = 3600.0
+
+    SWEEPER_ENABLED: bool = True
+    SWEEPER_BATCH_SIZE: int = 500
+    SWEEPER_BATCH_PAUSE: float = 0.1
+    SWEEPER_INTERVAL: float = 60.0
+
+    # Клики копятся в буфере (память или Redis по CACHE_BACKEND) и сбрасываются пачкой:
+    # при падении процесса теряется не больше CLICK_FLUSH_INTERVAL секунд / CLICK_BUFFER_MAX кликов
+    # (с Redis порог считается по кликам, записанным воркером с его последнего сброса)
+    CLICK_TRACKING_ENABLED: bool = True
+    CLICK_FLUSH_INTERVAL: float = 5.0
+    CLICK_BUFFER_MAX: int = 10000
+
+    # Пусто — обогащение выключено; например ["clearbit", "hunter"] или ["stub"]
+    ENRICHMENT_PROVIDERS: list[Literal["clearbit", "hunter", "stub"]] = []
+    CLEARBIT_API_KEY: Optional[str] = None
+    HUNTER_API_KEY: Optional[str] = None
+    ENRICHMENT_BATCH_SIZE: int = 50
+    ENRICHMENT_CONCURRENCY: int = 10
+    ENRICHMENT_TIMEOUT: float = 5.0
+    ENRICHMENT_POLL_INTERVAL: float = 5.0
+    ENRICHMENT_LEASE_SECONDS: int = 120
+    ENRICHMENT_MAX_ATTEMPTS: int = 5
+    ENRICHMENT_BACKOFF_BASE: float = 5.0
+    ENRICHMENT_BACKOFF_MAX: float = 3600.0
+    ENRICHMENT_CACHE_TTL: int = 86400
+
 
 settings = Settings()
\ No newline at end of file
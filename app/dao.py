@@ -1,37 +1,151 @@
-from .database import async_session_maker
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import after_commit, read_session_scope
+from .enrichment import enrichment_ctes
+from .metrics import instrument_dao
 from .models import User
+from .outbox import referral_event_cte
+from .principals import invalidate_principal
+from .singleflight import coalesce
+from referral_code.models import ReferralLink
+from referral_code.stats import referral_counter_ctes
 
-from sqlalchemy import select, insert, update
+from sqlalchemy import String, column, literal, or_, select, insert, update, values
 
+@instrument_dao
 class UserDAO:
         
     @classmethod
-    async def find_one_or_none(cls, **filter_by):
-        async with async_session_maker() as sesion:
-            query = select(User).filter_by(**filter_by)
-            result = await sesion.execute(query)
-            return result.scalar_one_or_none() 
+    async def find_one_or_none(cls, session: AsyncSession, **filter_by):
+        query = select(User).filter_by(**filter_by)
+        result = await session.execute(query)
+        return result.scalar_one_or_none() 
+
+    @classmethod
+    async def find_credentials(cls, session: AsyncSession, email: str):
+        query = select(User.id, User.password).where(User.email == email)
+        result = await session.execute(query)
+        return result.one_or_none()
+
+    @classmethod
+    @coalesce("principal")
+    async def find_principal(cls, session: AsyncSession, user_id: int):
+        query = select(User.id, User.email, User.code_id).where(User.id == user_id)
+        result = await session.execute(query)
+        return result.one_or_none()
         
 
     @classmethod
-    async def add(cls, **data):
-        async with async_session_maker() as session:
-            query = insert(User).values(**data).returning(User)
+    async def add(cls, session: AsyncSession, **data):
+        query = insert(User).values(**data).returning(User)
+        result = await session.execute(query)
+        return result.scalar_one()
+
+    @classmethod
+    async def register(cls, session: AsyncSession, email: str, password: str, referral_code: str | None = None):
+        # Один запрос: поиск кода, вставка, привязка, счётчики и событие в outbox; дубликат email ловит уникальный индекс.
+        # Возвращает (id пользователя, id кода); id пользователя None — вставки не было.
+        if referral_code is None:
+            query = (
+                pg_insert(User)
+                .values(email=email, password=password)
+                .on_conflict_do_nothing(index_elements=[User.email])
+                .returning(User.id, User.email)
+            )
+            if settings.ENRICHMENT_PROVIDERS:
+                inserted = query.cte("inserted")
+                query = select(inserted.c.id).add_cte(*enrichment_ctes(inserted))
             result = await session.execute(query)
-            await session.commit()
-            return result.scalar_one()
+            return result.scalar_one_or_none(), None
+
+        current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+        ref = select(ReferralLink.id).where(
+            (ReferralLink.code == referral_code) &
+            (ReferralLink.expiration_date > current_time)
+        ).cte("ref")
+        inserted = (
+            pg_insert(User)
+            .from_select(
+                ["email", "password", "code_id"],
+                select(literal(email, String), literal(password, String), ref.c.id),
+            )
+            .on_conflict_do_nothing(index_elements=[User.email])
+            .returning(User.id, User.email, User.code_id)
+            .cte("inserted")
+        )
+        query = (
+            select(select(inserted.c.id).scalar_subquery(), select(ref.c.id).scalar_subquery())
+            .add_cte(*referral_counter_ctes(inserted), referral_event_cte(inserted), *enrichment_ctes(inserted))
+        )
+        result = await session.execute(query)
+        return tuple(result.one())
+
+    @classmethod
+    async def register_many(cls, session: AsyncSession, users: list[tuple[str, str, str | None]]):
+        # Многострочная вставка (email, password, referral_code); email в пачке уникальны.
+        # Строки с недействительным кодом и существующим email пропускаются. Возвращает {email: (id, code_id)}.
+        current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = values(
+            column("email", String), column("password", String), column("code", String), name="new_users"
+        ).data(users)
+        source = select(rows.c.email, rows.c.password, ReferralLink.id).select_from(
+            rows.outerjoin(
+                ReferralLink,
+                (ReferralLink.code == rows.c.code) & (ReferralLink.expiration_date > current_time),
+            )
+        ).where(or_(rows.c.code.is_(None), ReferralLink.id.is_not(None)))
+        inserted = (
+            pg_insert(User)
+            .from_select(["email", "password", "code_id"], source)
+            .on_conflict_do_nothing(index_elements=[User.email])
+            .returning(User.id, User.email, User.code_id)
+            .cte("inserted")
+        )
+        query = (
+            select(inserted.c.id, inserted.c.email, inserted.c.code_id)
+            .add_cte(*referral_counter_ctes(inserted), referral_event_cte(inserted), *enrichment_ctes(inserted))
+        )
+        result = await session.execute(query)
+        return {email: (user_id, code_id) for user_id, email, code_id in result.all()}
 
             
     @classmethod
-    async def update(cls, user_id: int, **data):
-        async with async_session_maker() as session:
-            query = update(User).where(User.id == user_id).values(**data)
-            await session.execute(query)
-            await session.commit()
+    async def update(cls, session: AsyncSession, user_id: int, **data):
+        query = update(User).where(User.id == user_id).values(**data)
+        await session.execute(query)
+        after_commit(session, invalidate_principal, user_id)
     
     @classmethod
-    async def find_all(cls, code_id: int):
-        async with async_session_maker() as session:
-            query = select(User).where(User.code_id == code_id)
-            result = await session.execute(query)
-            return result.scalars().all()
+    async def find_all(cls, session: AsyncSession, code_id: int):
+        query = select(User).where(User.code_id == code_id)
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    @classmethod
+    async def find_page(cls, session: AsyncSession, code_id: int, after: int | None, limit: int):
+        # Keyset-пагинация по users.id: возвращает страницу и курсор следующей (или None)
+        query = select(User.id, User.email).where(User.code_id == code_id)
+        if after is not None:
+            query = query.where(User.id > after)
+        query = query.order_by(User.id).limit(limit + 1)
+        rows = (await session.execute(query)).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @classmethod
+    async def stream_by_code(cls, code_id: int, batch_size: int):
+        # Своя сессия: генератор читается уже после завершения запроса
+        async with read_session_scope() as session:
+            query = (
+                select(User.id, User.email)
+                .where(User.code_id == code_id)
+                .order_by(User.id)
+                .execution_options(yield_per=batch_size)
+            )
+            result = await session.stream(query)
+            async for row in result:
+                yield row
@@ -1,21 +1,201 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
+from .cache import MISSING, build_cache
 from .config import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float):
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+
+def timed_pool(base):
+    # Время ожидания соединения из пула; статистика — атрибут класса, чтобы пережить
+    # pool.recreate() при engine.dispose()
+    stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            self.stats.record(time.perf_counter() - started)
+
+    return type(f"Timed{base.__name__}", (base,), {"stats": stats, "_do_get": _do_get})
+
+
+def create_engine(url: str):
+    connect_args = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    if settings.MODE == 'TEST':
+        return create_async_engine(url, poolclass=timed_pool(NullPool), connect_args=connect_args)
+    return create_async_engine(
+        url,
+        poolclass=timed_pool(AsyncAdaptedQueuePool),
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
 if settings.MODE == 'TEST':
     DATABASE_URL = settings.TEST_DATABASE_URL
-    DATABASE_PARAMS = {"poolclass": NullPool}
 else:
     DATABASE_URL = settings.DATABASE_URL
-    DATABASE_PARAMS = {}
 
 
-engine = create_async_engine(DATABASE_URL, **DATABASE_PARAMS)
+engine = create_engine(DATABASE_URL)
 
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+
+class ReplicaSet:
+
+    def __init__(self, urls: list[str]):
+        self.engines = [create_engine(url) for url in urls]
+        self.session_makers = [
+            sessionmaker(replica, class_=AsyncSession, expire_on_commit=False) for replica in self.engines
+        ]
+        self.healthy = [True] * len(self.engines)
+        self.fallbacks = 0
+        self._next = itertools.count()
+
+    def pick(self) -> int | None:
+        # Round-robin по здоровым репликам; None — читать с primary
+        for _ in range(len(self.engines)):
+            index = next(self._next) % len(self.engines)
+            if self.healthy[index]:
+                return index
+        if self.engines:
+            self.fallbacks += 1
+        return None
+
+    def mark_unhealthy(self, index: int):
+        if self.healthy[index]:
+            logger.warning("Реплика %s недоступна, чтение переключено", index)
+        self.healthy[index] = False
+
+    async def check(self):
+        for index, replica in enumerate(self.engines):
+            try:
+                async with replica.connect() as conn:
+                    await asyncio.wait_for(conn.execute(text("SELECT 1")), settings.DB_REPLICA_HEALTH_INTERVAL)
+            except Exception:
+                self.mark_unhealthy(index)
+            else:
+                self.healthy[index] = True
+
+    async def run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.DB_REPLICA_HEALTH_INTERVAL)
+
+    async def dispose(self):
+        for replica in self.engines:
+            await replica.dispose()
+
+
+replicas = ReplicaSet(settings.DB_REPLICA_URLS)
+
+# Пользователи, недавно писавшие в primary, читают оттуда же (read-your-writes)
+primary_pins = build_cache("primary_pin", ttl=settings.DB_REPLICA_STICKY_SECONDS)
+
+
+async def pin_to_primary(*user_ids: int):
+    for user_id in user_ids:
+        await primary_pins.set(str(user_id), True)
+
+
+async def is_pinned_to_primary(user_id: int) -> bool:
+    return await primary_pins.get(str(user_id)) is not MISSING
+
+
+@asynccontextmanager
+async def session_scope():
+    # Одна сессия и одна транзакция на единицу работы (запрос, фоновая задача)
+    async with async_session_maker() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+    for callback, args in session.info.pop("after_commit", []):
+        await callback(*args)
+
+
+@asynccontextmanager
+async def read_session_scope(primary: bool = False):
+    # Сессия только для чтения: реплика, если есть здоровая, иначе primary
+    index = None if primary else replicas.pick()
+    if index is None:
+        session = async_session_maker()
+    else:
+        session = replicas.session_makers[index]()
+        try:
+            await session.connection()
+        except Exception:
+            await session.close()
+            replicas.mark_unhealthy(index)
+            session = async_session_maker()
+            index = None
+
+    # Откуда читает сессия — по этой роли single-flight объединяет только равноценные чтения
+    session.info["read_role"] = "primary" if index is None else "replica"
+    async with session:
+        yield session
+
+
+def after_commit(session: AsyncSession, callback, *args):
+    session.info.setdefault("after_commit", []).append((callback, args))
+
+
+def pool_stats() -> dict:
+    engines = [("primary", engine, True)]
+    engines += [
+        (f"replica_{index}", replica, replicas.healthy[index]) for index, replica in enumerate(replicas.engines)
+    ]
+
+    stats = {}
+    for name, current, healthy in engines:
+        pool = current.pool
+        queued = isinstance(pool, AsyncAdaptedQueuePool)
+        capacity = pool.size() + settings.DB_MAX_OVERFLOW if queued else None
+        checked_out = pool.checkedout() if queued else None
+        stats[name] = {
+            "healthy": healthy,
+            "checked_out": checked_out,
+            "capacity": capacity,
+            "utilization": checked_out / capacity if capacity else None,
+            "checkouts": pool.stats.checkouts,
+            "wait_avg": pool.stats.wait_total / pool.stats.checkouts if pool.stats.checkouts else 0.0,
+            "wait_max": pool.stats.wait_max,
+        }
+    return stats
+
+
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
@@ -4,6 +4,25 @@ from jose import jwt, JWTError
 from datetime import datetime, timezone
 from .config import settings
 from .dao import UserDAO
+from .database import is_pinned_to_primary, read_session_scope, session_scope
+from .principals import cache_principal, get_cached_principal, is_token_revoked
+from .schemas import SUserPrincipal
+
+
+async def get_session():
+    async with session_scope() as session:
+        yield session
+
+
+async def get_read_session():
+    async with read_session_scope() as session:
+        yield session
+
+
+async def get_primary_read_session():
+    # Для чтений, которые заполняют общие кеши: данные отстающей реплики остались бы в кеше до TTL
+    async with read_session_scope(primary=True) as session:
+        yield session
 
 
 def get_token(request: Request):
@@ -31,8 +50,27 @@ async def get_current(token: str = Depends(get_token)):
     
     user_id = int(user_id)
 
-    user = await UserDAO.find_one_or_none(id=user_id)
+    if await is_token_revoked(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    principal = await get_cached_principal(user_id)
+    if principal:
+        return principal
+
+    # Не в сессии запроса: чтение с primary в своей сессии объединяется с одновременными
+    # промахами кеша (single-flight) и не заполняет кеш данными отстающей реплики
+    async with read_session_scope(primary=True) as session:
+        user = await UserDAO.find_principal(session, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    return user
\ No newline at end of file
+    principal = SUserPrincipal.model_validate(user)
+    await cache_principal(principal, int(expire))
+    return principal
+
+
+async def get_user_read_session(current_user: SUserPrincipal = Depends(get_current)):
+    # После своих изменений пользователь читает с primary, пока реплики догоняют
+    primary = await is_pinned_to_primary(current_user.id)
+    async with read_session_scope(primary=primary) as session:
+        yield session
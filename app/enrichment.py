@@ -0,0 +1,314 @@
+import asyncio
+import logging
+from collections import Counter
+
+import httpx
+from sqlalchemy import Integer, column, delete, func, insert, literal, select, update, values
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import MISSING, build_cache
+from .config import settings
+from .database import session_scope
+from .metrics import instrument_dao
+from .models import EnrichmentTask, User
+
+
+logger = logging.getLogger(__name__)
+
+FREE_EMAIL_DOMAINS = {"gmail.com", "yahoo.com", "outlook.com", "hotmail.com", "mail.ru", "yandex.ru", "icloud.com"}
+
+
+def email_domain(email: str) -> str:
+    return email.rsplit("@", 1)[-1].lower()
+
+
+def enrichment_ctes(inserted) -> list:
+    # Постановка в очередь тем же запросом, что и регистрация; без провайдеров очередь не растёт
+    if not settings.ENRICHMENT_PROVIDERS:
+        return []
+    return [
+        insert(EnrichmentTask)
+        .from_select(["user_id", "email"], select(inserted.c.id, inserted.c.email))
+        .cte("enrichment_tasks")
+    ]
+
+
+class Provider:
+    # scope — по чему кешируется результат: "email" или "domain"
+    name = ""
+    scope = "email"
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.calls = 0
+
+    async def fetch_one(self, key: str) -> dict | None:
+        raise NotImplementedError
+
+    async def _bounded(self, key: str):
+        async with self.semaphore:
+            self.calls += 1
+            return await self.fetch_one(key)
+
+    async def fetch(self, keys: list[str]) -> dict:
+        # Ошибка по одному ключу не роняет пачку: на её месте остаётся исключение
+        results = await asyncio.gather(*(self._bounded(key) for key in keys), return_exceptions=True)
+        return dict(zip(keys, results))
+
+    async def close(self):
+        pass
+
+
+class StubProvider(Provider):
+    # Для тестов и окружений без доступа к внешним API
+    name = "stub"
+
+    async def fetch_one(self, key: str) -> dict:
+        domain = email_domain(key)
+        return {"domain": domain, "free_email": domain in FREE_EMAIL_DOMAINS}
+
+
+class HTTPProvider(Provider):
+
+    def __init__(self, concurrency: int, timeout: float, **client_options):
+        super().__init__(concurrency)
+        self.client = httpx.AsyncClient(timeout=timeout, **client_options)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class ClearbitProvider(HTTPProvider):
+    # Данные о компании по домену: одна компания на всех её сотрудников
+    name = "clearbit"
+    scope = "domain"
+    url = "https://company.clearbit.com/v2/companies/find"
+
+    def __init__(self, api_key: str, concurrency: int, timeout: float):
+        super().__init__(concurrency, timeout, headers={"Authorization": f"Bearer {api_key}"})
+
+    async def fetch_one(self, key: str) -> dict | None:
+        if key in FREE_EMAIL_DOMAINS:
+            return None
+        response = await self.client.get(self.url, params={"domain": key})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        return {
+            "name": data.get("name"),
+            "domain": data.get("domain"),
+            "sector": (data.get("category") or {}).get("sector"),
+            "employees": (data.get("metrics") or {}).get("employees"),
+            "country": (data.get("geo") or {}).get("country"),
+        }
+
+
+class HunterProvider(HTTPProvider):
+    # Проверка существования адреса (emailhunter / hunter.io)
+    name = "hunter"
+    url = "https://api.hunter.io/v2/email-verifier"
+
+    def __init__(self, api_key: str, concurrency: int, timeout: float):
+        super().__init__(concurrency, timeout)
+        self.api_key = api_key
+
+    async def fetch_one(self, key: str) -> dict:
+        response = await self.client.get(self.url, params={"email": key, "api_key": self.api_key})
+        if response.status_code == 202:
+            # Проверка ещё идёт на стороне hunter — повторим позже
+            raise RuntimeError("hunter: проверка не завершена")
+        response.raise_for_status()
+        data = response.json()["data"]
+        return {"status": data.get("status"), "result": data.get("result"), "score": data.get("score")}
+
+
+def build_providers() -> list[Provider]:
+    providers = []
+    for name in settings.ENRICHMENT_PROVIDERS:
+        if name == "stub":
+            providers.append(StubProvider(settings.ENRICHMENT_CONCURRENCY))
+            continue
+        api_key = settings.CLEARBIT_API_KEY if name == "clearbit" else settings.HUNTER_API_KEY
+        if not api_key:
+            raise ValueError(f"Для провайдера {name} нужен ключ API")
+        provider = ClearbitProvider if name == "clearbit" else HunterProvider
+        providers.append(provider(api_key, settings.ENRICHMENT_CONCURRENCY, settings.ENRICHMENT_TIMEOUT))
+    return providers
+
+
+@instrument_dao
+class EnrichmentDAO:
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, limit: int, lease: int):
+        # Как в outbox: аренда через available_at, чтобы не держать блокировки на время HTTP
+        now = func.timezone("utc", func.now())
+        batch = (
+            select(EnrichmentTask.user_id)
+            .where(EnrichmentTask.available_at <= now)
+            .order_by(EnrichmentTask.available_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        query = (
+            update(EnrichmentTask)
+            .where(EnrichmentTask.user_id == batch.c.user_id)
+            .values(
+                available_at=now + func.make_interval(0, 0, 0, 0, 0, 0, lease),
+                attempts=EnrichmentTask.attempts + 1,
+            )
+            .returning(EnrichmentTask.user_id, EnrichmentTask.email, EnrichmentTask.attempts)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def save(cls, session: AsyncSession, results: list[tuple[int, dict]]):
+        rows = values(column("user_id", Integer), column("data", JSONB), name="results").data(results)
+        query = (
+            update(User)
+            .where(User.id == rows.c.user_id)
+            .values(enrichment=rows.c.data, enriched_at=func.timezone("utc", func.now()))
+        )
+        await session.execute(query)
+        await session.execute(
+            delete(EnrichmentTask).where(EnrichmentTask.user_id.in_([user_id for user_id, _ in results]))
+        )
+
+    @classmethod
+    async def reschedule(cls, session: AsyncSession, user_ids: list[int]):
+        delay = func.least(
+            literal(settings.ENRICHMENT_BACKOFF_BASE) * func.power(2, EnrichmentTask.attempts - 1),
+            settings.ENRICHMENT_BACKOFF_MAX,
+        )
+        query = (
+            update(EnrichmentTask)
+            .where(EnrichmentTask.user_id.in_(user_ids))
+            .values(available_at=func.timezone("utc", func.now()) + func.make_interval(0, 0, 0, 0, 0, 0, delay))
+        )
+        await session.execute(query)
+
+
+class Enricher:
+    # Регистрация только ставит пользователя в очередь; провайдеры вызываются здесь,
+    # пачками, с ограничением параллельности и кешем по email/домену
+
+    def __init__(self, providers: list[Provider] | None = None):
+        self._providers = providers
+        self.cache = build_cache("enrichment", ttl=settings.ENRICHMENT_CACHE_TTL)
+        self.batches = 0
+        self.enriched = 0
+        self.retried = 0
+        self.errors = 0
+        self.provider_errors: Counter[str] = Counter()
+        self._wakeup: asyncio.Event | None = None
+
+    @property
+    def providers(self) -> list[Provider]:
+        if self._providers is None:
+            self._providers = build_providers()
+        return self._providers
+
+    async def lookup(self, provider: Provider, keys: set[str]) -> dict:
+        cache_keys = {key: f"{provider.name}:{key}" for key in keys}
+        cached = await self.cache.get_many(list(cache_keys.values()))
+        results = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cached[cache_key] is not MISSING}
+        missing = [key for key in keys if key not in results]
+        if missing:
+            fetched = await provider.fetch(missing)
+            results.update(fetched)
+            # Ошибки не кешируем, «не найдено» (None) — кешируем
+            await self.cache.set_many([
+                (cache_keys[key], value, None) for key, value in fetched.items() if not isinstance(value, Exception)
+            ])
+        return results
+
+    async def enrich(self, emails: list[str]) -> dict[str, tuple[dict, bool]]:
+        # {email: (данные по провайдерам, была ли ошибка)}
+        def key(provider: Provider, email: str) -> str:
+            return email_domain(email) if provider.scope == "domain" else email.lower()
+
+        lookups = await asyncio.gather(*(
+            self.lookup(provider, {key(provider, email) for email in emails}) for provider in self.providers
+        ))
+        enriched = {}
+        for email in emails:
+            data, failed = {}, False
+            for provider, results in zip(self.providers, lookups):
+                value = results[key(provider, email)]
+                if isinstance(value, Exception):
+                    self.provider_errors[provider.name] += 1
+                    data[provider.name] = {"error": repr(value)[:200]}
+                    failed = True
+                else:
+                    data[provider.name] = value
+            enriched[email] = (data, failed)
+        return enriched
+
+    async def process_once(self, limit: int | None = None) -> int:
+        limit = limit or settings.ENRICHMENT_BATCH_SIZE
+        async with session_scope() as session:
+            tasks = await EnrichmentDAO.claim(session, limit, settings.ENRICHMENT_LEASE_SECONDS)
+        if not tasks:
+            return 0
+
+        enriched = await self.enrich(list({task.email for task in tasks}))
+        done, retry = [], []
+        for task in tasks:
+            data, failed = enriched[task.email]
+            if failed and task.attempts < settings.ENRICHMENT_MAX_ATTEMPTS:
+                retry.append(task.user_id)
+            else:
+                done.append((task.user_id, data))
+
+        async with session_scope() as session:
+            if done:
+                await EnrichmentDAO.save(session, done)
+            if retry:
+                await EnrichmentDAO.reschedule(session, retry)
+        self.batches += 1
+        self.enriched += len(done)
+        self.retried += len(retry)
+        return len(tasks)
+
+    async def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                processed = await self.process_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка обогащения данных пользователей")
+                processed = 0
+            if processed < settings.ENRICHMENT_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.ENRICHMENT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def close(self):
+        for provider in self._providers or []:
+            await provider.close()
+
+    def stats(self) -> dict:
+        stats = {
+            "batches": self.batches,
+            "enriched": self.enriched,
+            "retried": self.retried,
+            "errors": self.errors,
+        }
+        for provider in self._providers or []:
+            stats[f"{provider.name}_calls"] = provider.calls
+            stats[f"{provider.name}_errors"] = self.provider_errors[provider.name]
+        return stats
+
+
+enricher = Enricher()
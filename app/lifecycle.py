@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+
+from jose import jwt
+from sqlalchemy import text
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    # Прогрев при старте: первые запросы после деплоя не платят за соединения,
+    # bcrypt и компиляцию SQL
+
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.ready = False
+        self.startup_seconds = 0.0
+        self.warmup: dict[str, float] = {}
+
+    async def _step(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            # Прогрев — оптимизация: ошибка не должна мешать старту
+            logger.warning("Прогрев %s не удался", name, exc_info=True)
+        self.warmup[name] = round(time.perf_counter() - started, 4)
+
+    async def prewarm_pool(self, engine, size: int):
+        # Держим все соединения одновременно, иначе пул выдаст одно и то же
+        async with AsyncExitStack() as stack:
+            connections = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(size)))
+            await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
+
+    async def warmup_pools(self):
+        from .database import engine, replicas
+
+        size = min(settings.DB_POOL_PREWARM, settings.DB_POOL_SIZE)
+        await self.prewarm_pool(engine, size)
+        for index, replica in enumerate(replicas.engines):
+            if replicas.healthy[index]:
+                await self.prewarm_pool(replica, size)
+
+    async def warmup_hashing(self):
+        # По одному хешу на воркер: поднимаются процессы пула и бэкенд bcrypt в passlib
+        from .hashing import password_hasher
+
+        hashes = await asyncio.gather(*(password_hasher.hash("warmup") for _ in range(password_hasher.workers)))
+        await password_hasher.verify_and_update("warmup", hashes[0])
+
+    async def warmup_jwt(self):
+        from .auth import create_access_token
+
+        token = create_access_token({"sub": "0"})
+        jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+
+    async def warmup_statements(self):
+        # Запросы горячих путей с заведомо пустым результатом: SQLAlchemy кеширует
+        # скомпилированный SQL, asyncpg — подготовленные выражения на соединении
+        from .dao import UserDAO
+        from .database import async_session_maker
+        from referral_code.dao import CodeDAO
+
+        async with async_session_maker() as session:
+            await UserDAO.find_credentials(session, "")
+            await UserDAO.find_principal(session, 0)
+            await UserDAO.find_page(session, 0, None, 1)
+            await CodeDAO.find_active_code_by_user(session, 0)
+            await CodeDAO.find_summary(session, 0)
+            await CodeDAO.exists(session, 0)
+
+    async def startup(self):
+        self.ready = False
+        self.warmup = {}
+        if settings.WARMUP_ENABLED:
+            started = time.perf_counter()
+            await asyncio.gather(
+                self._step("pool", self.warmup_pools()),
+                self._step("hashing", self.warmup_hashing()),
+                self._step("jwt", self.warmup_jwt()),
+            )
+            await self._step("statements", self.warmup_statements())
+            self.warmup["total"] = round(time.perf_counter() - started, 4)
+        self.startup_seconds = round(time.perf_counter() - self.created_at, 4)
+        self.ready = True
+        logger.info("Приложение запущено за %.2f с, прогрев: %s", self.startup_seconds, self.warmup)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "startup_seconds": self.startup_seconds,
+            **{f"warmup_{name}_seconds": seconds for name, seconds in self.warmup.items()},
+        }
+
+
+lifecycle = Lifecycle()
+
@@ -1,12 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
+from .config import settings
+from .database import engine, replicas
+from .enrichment import enricher
+from .lifecycle import lifecycle
+from .metrics import setup_metrics
+from .outbox import outbox_dispatcher
+from .profiler import setup_profiler
 from .router import router as user_router
+from referral_code.bloom import code_filter
+from referral_code.clicks import click_tracker
+from referral_code.pool import code_pool
 from referral_code.router import router as code_router
+from referral_code.sweeper import sweeper
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев до приёма запросов: соединения пула, bcrypt, JWT и компиляция запросов DAO
+    await lifecycle.startup()
+
+    tasks = []
+    if settings.CODE_POOL_ENABLED:
+        tasks.append(asyncio.create_task(code_pool.run()))
+    if settings.CODE_FILTER_ENABLED:
+        tasks.append(asyncio.create_task(code_filter.run()))
+    if settings.CLICK_TRACKING_ENABLED:
+        tasks.append(asyncio.create_task(click_tracker.run()))
+    if settings.SWEEPER_ENABLED:
+        tasks.append(asyncio.create_task(sweeper.run()))
+    if settings.OUTBOX_ENABLED:
+        tasks.append(asyncio.create_task(outbox_dispatcher.run()))
+    if settings.ENRICHMENT_PROVIDERS:
+        tasks.append(asyncio.create_task(enricher.run()))
+    if replicas.engines:
+        tasks.append(asyncio.create_task(replicas.run()))
+
+    yield
+
+    # Сюда uvicorn приходит, когда соединения уже закрыты: ожидание текущих запросов —
+    # его --timeout-graceful-shutdown
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    if settings.CLICK_TRACKING_ENABLED:
+        # Остаток буфера — до закрытия соединений, чтобы не терять клики при деплое
+        with suppress(Exception):
+            await click_tracker.flush()
+    await outbox_dispatcher.close()
+    await enricher.close()
+    await replicas.dispose()
+    await engine.dispose()
 
 
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    setup_metrics(app)
+    setup_profiler(app)
 
-app = FastAPI()
+    app.include_router(user_router)
+    app.include_router(code_router)
+    return app
 
 
-app.include_router(user_router)
-app.include_router(code_router)
+app = create_app()
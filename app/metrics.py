@@ -0,0 +1,185 @@
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .profiler import record_query
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения SQL-запроса по методам DAO",
+    ["engine", "dao", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "Ошибки SQL-запросов", ["engine", "dao"])
+HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds",
+    "Время bcrypt с учётом ожидания в очереди",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1, 2, 5),
+)
+
+current_dao: ContextVar[str] = ContextVar("current_dao", default="other")
+
+
+def instrument_dao(cls):
+    # Помечает запросы каждого async-метода DAO его именем для db_query_duration_seconds
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, classmethod) or not inspect.iscoroutinefunction(attr.__func__):
+            continue
+        label = f"{cls.__name__}.{name}"
+
+        def wrap(func, label=label):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                token = current_dao.set(label)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    current_dao.reset(token)
+            return wrapper
+
+        setattr(cls, name, classmethod(wrap(attr.__func__)))
+    return cls
+
+
+def instrument_engine(engine, name: str):
+    # Единственные хуки на запросы движка: одно измерение идёт и в гистограмму, и в профиль запроса
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+        DB_QUERY_LATENCY.labels(name, current_dao.get(), operation).observe(elapsed)
+        record_query(conn, statement, parameters, executemany, elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        DB_QUERY_ERRORS.labels(name, current_dao.get()).inc()
+
+
+class MetricsMiddleware:
+    # Чистый ASGI без BaseHTTPMiddleware: одна запись в гистограмму на запрос
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Шаблон пути, а не сам путь: /referral/{referral_link_id}, чтобы не плодить серии
+            path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], path, str(status)).observe(time.perf_counter() - started)
+
+
+class StatsCollector:
+    # Счётчики компонентов, которые уже ведут свою статистику, отдаются как gauges при сборе
+
+    def collect(self):
+        from .cache import MemoryCache, caches
+        from .database import pool_stats
+        from .enrichment import enricher
+        from .hashing import password_hasher
+        from .lifecycle import lifecycle
+        from .outbox import outbox_dispatcher
+        from .principals import revoked_tokens
+        from .ratelimit import rate_limiter
+        from .singleflight import single_flight
+        from referral_code.bloom import code_filter
+        from referral_code.clicks import click_tracker
+        from referral_code.pool import code_pool
+        from referral_code.sweeper import sweeper
+
+        pool = GaugeMetricFamily("db_pool", "Состояние пулов соединений", labels=["engine", "stat"])
+        for name, stats in pool_stats().items():
+            for stat in ("checked_out", "capacity", "utilization", "checkouts", "wait_avg", "wait_max"):
+                if stats[stat] is not None:
+                    pool.add_metric([name, stat], stats[stat])
+            pool.add_metric([name, "healthy"], int(stats["healthy"]))
+        yield pool
+
+        cache = GaugeMetricFamily("cache", "Попадания и промахи кешей", labels=["namespace", "stat"])
+        for namespace, current in caches.items():
+            cache.add_metric([namespace, "hits"], current.hits)
+            cache.add_metric([namespace, "misses"], current.misses)
+            if isinstance(current, MemoryCache):
+                cache.add_metric([namespace, "size"], len(current._data))
+                cache.add_metric([namespace, "evictions"], current.evictions)
+        yield cache
+
+        for metric, description, stats in (
+            ("lifecycle", "Запуск, прогрев и остановка приложения", lifecycle.stats()),
+            ("password_hasher", "Очередь и счётчики bcrypt", password_hasher.stats()),
+            ("rate_limiter", "Ограничение частоты запросов", rate_limiter.stats()),
+            ("revoked_tokens", "Отозванные при выходе токены (память процесса)", revoked_tokens.stats()),
+            ("single_flight", "Объединение одинаковых одновременных запросов к базе", single_flight.stats()),
+            ("code_pool", "Пул реферальных кодов", code_pool.stats()),
+            ("code_filter", "Фильтр Блума по выданным реферальным кодам", code_filter.stats()),
+            ("clicks", "Буфер переходов по реферальным ссылкам", click_tracker.stats()),
+            ("sweeper", "Архивация истёкших кодов", sweeper.stats()),
+            ("outbox", "Доставка событий из outbox", outbox_dispatcher.stats()),
+            ("enrichment", "Обогащение данных пользователей", enricher.stats()),
+        ):
+            family = GaugeMetricFamily(metric, description, labels=["stat"])
+            for stat, value in stats.items():
+                if isinstance(value, (int, float)):
+                    family.add_metric([stat], value)
+            yield family
+
+
+async def metrics_endpoint(request: Request):
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+_collector: StatsCollector | None = None
+
+
+def setup_metrics(app):
+    global _collector
+    from .database import engine, replicas
+
+    # Движки и реестр общие для процесса: create_app() может вызываться повторно (тесты)
+    if _collector is None:
+        instrument_engine(engine, "primary")
+        for index, replica in enumerate(replicas.engines):
+            instrument_engine(replica, f"replica_{index}")
+        _collector = StatsCollector()
+        REGISTRY.register(_collector)
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
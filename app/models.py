@@ -1,5 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, String, Text, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred, relationship
 
 from .database import Base
 from referral_code.models import ReferralLink
@@ -7,10 +8,41 @@ from referral_code.models import ReferralLink
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Покрывающий индекс: поиск по email отдаёт id и code_id без обращения к таблице
+        Index('ix_users_email', 'email', unique=True, postgresql_include=['id', 'code_id']),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    email = Column(String(255), unique=True)
+    email = Column(String(255))
     password = Column(String(255))
-    code_id = Column(Integer, ForeignKey('referral_link.id'), nullable=True) 
+    code_id = Column(Integer, ForeignKey('referral_link.id'), nullable=True, index=True)
+    created_at = Column(DateTime, server_default=text("timezone('utc', now())"))
+    # Данные внешних провайдеров; не загружается вместе с пользователем без явного запроса
+    enrichment = deferred(Column(JSONB))
+    enriched_at = Column(DateTime)
 
-    code = relationship('ReferralLink', back_populates='users') 
\ No newline at end of file
+    code = relationship('ReferralLink', back_populates='users', foreign_keys=[code_id])
+
+
+class OutboxEvent(Base):
+    __tablename__ = 'outbox_events'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    event_type = Column(String(64), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, server_default=text("timezone('utc', now())"))
+    # Когда событие можно забрать: сдвигается на время аренды и при повторных попытках
+    available_at = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"), index=True)
+    attempts = Column(Integer, nullable=False, server_default="0")
+    last_error = Column(Text)
+
+
+class EnrichmentTask(Base):
+    # Очередь обогащения: строка живёт от регистрации до сохранения данных провайдеров
+    __tablename__ = 'enrichment_queue'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    email = Column(String(255), nullable=False)
+    available_at = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"), index=True)
+    attempts = Column(Integer, nullable=False, server_default="0")
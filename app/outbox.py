@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import session_scope
+from .metrics import instrument_dao
+from .models import OutboxEvent
+from referral_code.models import ReferralLink
+
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_REGISTERED = "referral.registered"
+
+
+def referral_event_cte(inserted):
+    # Событие пишется тем же запросом, что и пользователь: транзакция общая,
+    # регистрация не делает лишних обращений к базе
+    payload = func.jsonb_build_object(
+        "user_id", inserted.c.id,
+        "email", inserted.c.email,
+        "code_id", inserted.c.code_id,
+        "code", ReferralLink.code,
+        "owner_id", ReferralLink.owner_id,
+        "registered_at", func.timezone("utc", func.now()),
+    )
+    return (
+        insert(OutboxEvent)
+        .from_select(
+            ["event_type", "payload"],
+            select(literal(REFERRAL_REGISTERED), payload)
+            .select_from(inserted.join(ReferralLink, ReferralLink.id == inserted.c.code_id)),
+        )
+        .cte("referral_events")
+    )
+
+
+@instrument_dao
+class OutboxDAO:
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, limit: int, lease: int):
+        # Забираем пачку и сразу сдвигаем available_at на время аренды: если воркер
+        # упадёт до подтверждения, события снова станут доступны (at-least-once)
+        now = func.timezone("utc", func.now())
+        batch = (
+            select(OutboxEvent.id)
+            .where(OutboxEvent.available_at <= now)
+            .order_by(OutboxEvent.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        query = (
+            update(OutboxEvent)
+            .where(OutboxEvent.id == batch.c.id)
+            .values(
+                available_at=now + func.make_interval(0, 0, 0, 0, 0, 0, lease),
+                attempts=OutboxEvent.attempts + 1,
+            )
+            .returning(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.attempts)
+        )
+        result = await session.execute(query)
+        return sorted(result.all(), key=lambda row: row.id)
+
+    @classmethod
+    async def delete(cls, session: AsyncSession, ids: list[int]):
+        await session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+
+    @classmethod
+    async def reschedule(cls, session: AsyncSession, ids: list[int], error: str):
+        # Экспоненциальная задержка по числу попыток, не больше OUTBOX_BACKOFF_MAX
+        delay = func.least(
+            literal(settings.OUTBOX_BACKOFF_BASE) * func.power(2, OutboxEvent.attempts - 1),
+            settings.OUTBOX_BACKOFF_MAX,
+        )
+        query = (
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids))
+            .values(
+                available_at=func.timezone("utc", func.now()) + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+                last_error=error[:1000],
+            )
+        )
+        await session.execute(query)
+
+
+def serialize(row) -> dict:
+    return {"id": row.id, "type": row.event_type, "attempt": row.attempts, "payload": row.payload}
+
+
+class MemorySink:
+    # Для тестов и локальной разработки
+
+    def __init__(self):
+        self.events: list[dict] = []
+
+    async def send(self, events: list[dict]):
+        self.events.extend(events)
+
+    async def close(self):
+        pass
+
+
+class FileSink:
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def _write(self, lines: str):
+        with self.path.open("a", encoding="utf-8") as stream:
+            stream.write(lines)
+
+    async def send(self, events: list[dict]):
+        lines = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self):
+        pass
+
+
+class WebhookSink:
+    # Вся пачка одним POST; получатель должен быть идемпотентен по id события
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, events: list[dict]):
+        response = await self.client.post(self.url, json={"events": events})
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def build_sink():
+    if settings.OUTBOX_SINK == "webhook":
+        if not settings.OUTBOX_WEBHOOK_URL:
+            raise ValueError("Для OUTBOX_SINK=webhook нужен OUTBOX_WEBHOOK_URL")
+        return WebhookSink(settings.OUTBOX_WEBHOOK_URL, settings.OUTBOX_WEBHOOK_TIMEOUT)
+    if settings.OUTBOX_SINK == "memory":
+        return MemorySink()
+    return FileSink(settings.OUTBOX_FILE_PATH)
+
+
+class OutboxDispatcher:
+
+    def __init__(self, sink=None):
+        self._sink = sink
+        self.batches = 0
+        self.delivered = 0
+        self.failed = 0
+        self.errors = 0
+        self.seconds_total = 0.0
+
+    @property
+    def sink(self):
+        if self._sink is None:
+            self._sink = build_sink()
+        return self._sink
+
+    async def dispatch_once(self, limit: int | None = None) -> int:
+        # Аренда фиксируется отдельной транзакцией: доставка идёт без открытой транзакции
+        # и без блокировок, а удаление подтверждает её
+        limit = limit or settings.OUTBOX_BATCH_SIZE
+        async with session_scope() as session:
+            rows = await OutboxDAO.claim(session, limit, settings.OUTBOX_LEASE_SECONDS)
+        if not rows:
+            return 0
+
+        ids = [row.id for row in rows]
+        started = time.perf_counter()
+        try:
+            await self.sink.send([serialize(row) for row in rows])
+        except Exception as exc:
+            self.failed += len(rows)
+            logger.warning("Не удалось доставить %d событий", len(rows), exc_info=True)
+            async with session_scope() as session:
+                await OutboxDAO.reschedule(session, ids, repr(exc))
+            return 0
+
+        self.seconds_total += time.perf_counter() - started
+        async with session_scope() as session:
+            await OutboxDAO.delete(session, ids)
+        self.batches += 1
+        self.delivered += len(rows)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                delivered = await self.dispatch_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка отправки событий из outbox")
+                delivered = 0
+            # Полная пачка — вероятно, есть ещё: забираем сразу, без паузы
+            if delivered < settings.OUTBOX_BATCH_SIZE:
+                await asyncio.sleep(settings.OUTBOX_POLL_INTERVAL)
+
+    async def close(self):
+        if self._sink is not None:
+            await self._sink.close()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "errors": self.errors,
+            "send_seconds_avg": self.seconds_total / self.batches if self.batches else 0.0,
+        }
+
+
+outbox_dispatcher = OutboxDispatcher()
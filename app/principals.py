@@ -0,0 +1,85 @@
+import hashlib
+import heapq
+import time
+from datetime import datetime, timezone
+
+from jose import jwt
+
+from .cache import MISSING, build_cache, get_redis
+from .config import settings
+from .schemas import SUserPrincipal
+from .singleflight import single_flight
+
+
+class TokenDenylist:
+    # Отозванные токены — не кеш: без вытеснения по размеру, запись живёт до exp токена.
+    # В памяти отзыв действует только в своём воркере, поэтому при WORKERS > 1 настройки
+    # требуют CACHE_BACKEND=redis
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._expires: dict[str, int] = {}
+        self._queue: list[tuple[int, str]] = []
+
+    def _purge(self, now: float):
+        while self._queue and self._queue[0][0] <= now:
+            expire, key = heapq.heappop(self._queue)
+            if self._expires.get(key) == expire:
+                del self._expires[key]
+
+    async def add(self, key: str, expire: int):
+        if settings.CACHE_BACKEND == "redis":
+            await get_redis().set(f"{self.namespace}:{key}", 1, exat=expire)
+            return
+        self._purge(time.time())
+        self._expires[key] = expire
+        heapq.heappush(self._queue, (expire, key))
+
+    async def contains(self, key: str) -> bool:
+        if settings.CACHE_BACKEND == "redis":
+            return bool(await get_redis().exists(f"{self.namespace}:{key}"))
+        expire = self._expires.get(key)
+        return expire is not None and expire > time.time()
+
+    def stats(self) -> dict:
+        return {"size": len(self._expires)}
+
+
+principal_cache = build_cache("principal", ttl=settings.AUTH_CACHE_TTL)
+revoked_tokens = TokenDenylist("revoked_token")
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def get_cached_principal(user_id: int):
+    cached = await principal_cache.get(str(user_id))
+    if cached is MISSING:
+        return None
+    return SUserPrincipal(**cached)
+
+
+async def cache_principal(principal: SUserPrincipal, expire: int):
+    ttl = min(settings.AUTH_CACHE_TTL, expire - int(datetime.now(timezone.utc).timestamp()))
+    if ttl > 0:
+        await principal_cache.set(str(principal.id), principal.model_dump(), ttl=ttl)
+
+
+async def invalidate_principal(*user_ids: int):
+    for user_id in user_ids:
+        single_flight.forget("principal", user_id)
+    await principal_cache.delete(*(str(user_id) for user_id in user_ids))
+
+
+async def is_token_revoked(token: str) -> bool:
+    return await revoked_tokens.contains(token_key(token))
+
+
+async def revoke_token(token: str):
+    try:
+        expire = int(jwt.get_unverified_claims(token).get("exp", 0))
+    except Exception:
+        return
+    if expire > int(datetime.now(timezone.utc).timestamp()):
+        await revoked_tokens.add(token_key(token), expire)
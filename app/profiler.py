@@ -0,0 +1,142 @@
+import logging
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryProfile:
+
+    def __init__(self, route: str, budget: int):
+        self.route = route
+        self.budget = budget
+        self.statements: list[tuple[str, float]] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def total_time(self) -> float:
+        return sum(elapsed for _, elapsed in self.statements)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.count > self.budget
+
+    def summary(self) -> dict:
+        return {
+            "route": self.route,
+            "count": self.count,
+            "budget": self.budget,
+            "total_ms": round(self.total_time * 1000, 2),
+            "statements": [
+                {"sql": statement, "ms": round(elapsed * 1000, 2)} for statement, elapsed in self.statements
+            ],
+        }
+
+
+current_profile: ContextVar[QueryProfile | None] = ContextVar("current_profile", default=None)
+
+_PARAM_LIST = re.compile(r"\(\s*\$\d+(?:\s*,\s*\$\d+)*\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    # Одинаковые запросы с разными значениями и длиной IN-списков сводятся к одному тексту
+    statement = _PARAM_LIST.sub("(...)", statement)
+    statement = _LITERAL.sub("?", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+def query_budget(route: str) -> int:
+    return settings.QUERY_BUDGETS.get(route, settings.QUERY_BUDGET)
+
+
+@contextmanager
+def profile_queries(route: str = "manual", budget: int | None = None):
+    profile = QueryProfile(route, query_budget(route) if budget is None else budget)
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+
+def explain(conn, statement: str, parameters) -> str:
+    # Отдельный курсор, чтобы не затереть результат исходного запроса
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN {statement}", parameters)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def record_query(conn, statement: str, parameters, executemany: bool, elapsed: float):
+    # Вызывается из общих хуков движка (app.metrics.instrument_engine): время запроса меряется один раз
+    profile = current_profile.get()
+    if profile is None:
+        return
+    profile.statements.append((normalize(statement), elapsed))
+
+    if elapsed < settings.SLOW_QUERY_THRESHOLD:
+        return
+    plan = None
+    if settings.SLOW_QUERY_EXPLAIN and not executemany:
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception:
+            logger.debug("Не удалось получить план медленного запроса", exc_info=True)
+    logger.warning(
+        "Медленный запрос %.1f мс в %s:\n%s\n%s",
+        elapsed * 1000, profile.route, normalize(statement), plan or "",
+    )
+
+
+class QueryProfilerMiddleware:
+    # Включается настройкой QUERY_PROFILING; выключенный стоит одну проверку на запрос
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.QUERY_PROFILING:
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile(scope["path"], settings.QUERY_BUDGET)
+        token = current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                profile.route = getattr(route, "path", scope["path"])
+                profile.budget = query_budget(profile.route)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(profile.count).encode()))
+                headers.append((b"x-query-time-ms", f"{profile.total_time * 1000:.2f}".encode()))
+                if profile.over_budget:
+                    headers.append((b"x-query-budget-exceeded", str(profile.budget).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            if profile.over_budget:
+                logger.warning(
+                    "%s %s: %d SQL-запросов при бюджете %d (%.1f мс)",
+                    scope["method"], profile.route, profile.count, profile.budget, profile.total_time * 1000,
+                )
+                logger.info("Запросы %s: %s", profile.route, profile.summary()["statements"])
+
+
+def setup_profiler(app):
+    app.add_middleware(QueryProfilerMiddleware)
@@ -0,0 +1,187 @@
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+
+from .cache import get_redis
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rule(rule: str) -> tuple[int, int]:
+    # "10/60" — не больше 10 запросов за 60 секунд
+    limit, window = rule.split("/")
+    return int(limit), int(window)
+
+
+class MemoryLimiter:
+    # Token bucket в памяти процесса: ёмкость limit, пополнение limit/window в секунду
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: int, cost: int = 1) -> float:
+        now = time.monotonic()
+        rate = limit / window
+        tokens, updated = self._buckets.get(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * rate)
+
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            return window if cost > limit else (cost - tokens) / rate
+
+        self._buckets[key] = (tokens - cost, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return 0.0
+
+    async def clear(self):
+        self._buckets.clear()
+
+
+# Скользящее окно на sorted set: атомарно чистим старые отметки, считаем и добавляем новые.
+# Возвращает 0, если запрос пропущен, иначе сколько миллисекунд ждать.
+SLIDING_WINDOW = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+local count = redis.call('ZCARD', key)
+if count + cost > limit then
+    if cost > limit then
+        return window
+    end
+    local oldest = redis.call('ZRANGE', key, count + cost - limit - 1, count + cost - limit - 1, 'WITHSCORES')
+    return math.max(tonumber(oldest[2]) + window - now, 1)
+end
+for i = 1, cost do
+    redis.call('ZADD', key, now, ARGV[5] .. ':' .. i)
+end
+redis.call('PEXPIRE', key, window)
+return 0
+"""
+
+
+class RedisLimiter:
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._script = None
+
+    async def hit(self, key: str, limit: int, window: int, cost: int = 1) -> float:
+        if self._script is None:
+            self._script = get_redis().register_script(SLIDING_WINDOW)
+        now = int(time.time() * 1000)
+        wait = await self._script(
+            keys=[f"{self.namespace}:{key}"],
+            args=[now, window * 1000, limit, cost, uuid.uuid4().hex],
+        )
+        return int(wait) / 1000
+
+
+class RateLimiter:
+
+    def __init__(self):
+        self.memory = MemoryLimiter(settings.CACHE_MAXSIZE)
+        self.redis = RedisLimiter("ratelimit")
+        self.redis_down_until = 0.0
+        self.allowed = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    async def _hit(self, key: str, limit: int, window: int, cost: int) -> float:
+        if settings.RATE_LIMIT_BACKEND == "redis" and time.monotonic() >= self.redis_down_until:
+            try:
+                return await self.redis.hit(key, limit, window, cost)
+            except Exception:
+                # Redis недоступен — считаем в памяти процесса и пробуем снова позже
+                logger.warning("Redis недоступен, лимиты считаются в памяти процесса", exc_info=True)
+                self.fallbacks += 1
+                self.redis_down_until = time.monotonic() + settings.RATE_LIMIT_REDIS_RETRY
+        return await self.memory.hit(key, limit, window, cost)
+
+    async def hit(self, key: str, rule: str, cost: int = 1) -> float:
+        limit, window = parse_rule(rule)
+        wait = await self._hit(key, limit, window, cost)
+        if wait:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "backend": settings.RATE_LIMIT_BACKEND,
+            "redis_available": time.monotonic() >= self.redis_down_until,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+def client_ip(request: Request) -> str:
+    if settings.RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def request_emails(request: Request) -> list[str]:
+    # Тело уже прочитано FastAPI до зависимостей, повторное чтение берётся из кеша запроса
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            return []
+        items = body if isinstance(body, list) else [body]
+        return [item["email"] for item in items if isinstance(item, dict) and isinstance(item.get("email"), str)]
+
+    form = await request.form()
+    username = form.get("username")
+    return [username] if isinstance(username, str) else []
+
+
+def too_many_requests(wait: float):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Слишком много запросов, повторите попытку позже",
+        headers={"Retry-After": str(max(math.ceil(wait), 1))},
+    )
+
+
+def rate_limit(route: str):
+    # Зависимость для эндпоинтов с bcrypt: проверяется до запросов в базу и хеширования.
+    # Лимиты берутся из settings.RATE_LIMITS по ключам "<route>:ip" и "<route>:email".
+    async def dependency(request: Request):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        emails = await request_emails(request)
+        ip_rule = settings.RATE_LIMITS.get(f"{route}:ip")
+        if ip_rule:
+            wait = await rate_limiter.hit(f"{route}:ip:{client_ip(request)}", ip_rule, cost=max(len(emails), 1))
+            if wait:
+                raise too_many_requests(wait)
+
+        email_rule = settings.RATE_LIMITS.get(f"{route}:email")
+        if email_rule:
+            for email in {email.lower() for email in emails}:
+                wait = await rate_limiter.hit(f"{route}:email:{email}", email_rule)
+                if wait:
+                    raise too_many_requests(wait)
+
+    return dependency
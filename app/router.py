@@ -1,14 +1,21 @@
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from datetime import timedelta
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import User
 from .dao import UserDAO
-from .schemas import SUserRegister, SUserLogin
-from .auth import get_current_user, get_password_hash, authenticate_user, create_access_token
+from .schemas import SAccessToken, SUserPrincipal, SUserRegister, SUserRegisterResult, SUserLogin
+from .auth import get_password_hash, get_password_hashes, authenticate_user, create_access_token
+from .dependencies import get_current, get_session
+from .enrichment import enricher
+from .principals import revoke_token
+from .ratelimit import rate_limit
 from app.config import settings
+from app.database import after_commit
+from referral_code.bloom import code_filter
 from referral_code.dao import CodeDAO
+from referral_code.tree import invalidate_referral_trees
 
 
 
@@ -19,8 +26,12 @@ router = APIRouter(
 
 
 
-@router.post('/token')
-async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
+@router.post('/token', dependencies=[Depends(rate_limit("token"))])
+async def login_for_access_token(
+    response: Response,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    session: AsyncSession = Depends(get_session),
+) -> SAccessToken:
     try:
         email: EmailStr = form_data.username
     except ValueError:
@@ -29,7 +40,7 @@ async def login_for_access_token(response: Response, form_data: OAuth2PasswordRe
             detail="Неверный формат email в поле username"
         )
 
-    user = await authenticate_user(email, form_data.password) 
+    user = await authenticate_user(session, email, form_data.password) 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный email или пароль"
@@ -39,40 +50,107 @@ async def login_for_access_token(response: Response, form_data: OAuth2PasswordRe
         data={"sub": str(user.id)}, expires_delta=access_token_expires
     )
     response.set_cookie('user_access_token', access_token, httponly=True)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return SAccessToken(access_token=access_token, token_type="bearer")
 
 
 
-@router.post('/register')
-async def register_user(response: Response, user_data: SUserRegister):
-    existing_user = await UserDAO.find_one_or_none(email=user_data.email)
-    if existing_user:
+@router.post('/register', dependencies=[Depends(rate_limit("register"))])
+async def register_user(
+    response: Response,
+    user_data: SUserRegister,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
+) -> str:
+    referral_code = user_data.referral_code or None
+    if referral_code and not await code_filter.might_exist(referral_code):
+        # Кода нет — ни bcrypt, ни записи в базу
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Недействительный или истекший реферальный код"
+        )
+
+    # Хешируем до первого запроса, чтобы не держать соединение на время bcrypt
+    hashed_password = await get_password_hash(user_data.password)
+
+    user_id, code_id = await UserDAO.register(session, user_data.email, hashed_password, referral_code)
+
+    if referral_code and not code_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Недействительный или истекший реферальный код"
+        )
+    if not user_id:
         raise HTTPException(status_code=409, detail='Email уже существует')
+
+    if settings.ENRICHMENT_PROVIDERS:
+        after_commit(session, enricher.wake)
+    if code_id:
+        after_commit(session, CodeDAO.invalidate_code_by_email, user_data.email)
+        # Поиск предков для сброса кеша деревьев — уже после ответа клиенту
+        background_tasks.add_task(invalidate_referral_trees, code_id)
     
-    hashed_password = get_password_hash(user_data.password)
-    
-    user = await UserDAO.add(email=user_data.email, password=hashed_password)
-    if not user:
-        raise HTTPException(status_code=500, detail='Ошибка при создании пользователя')
-    
-    if user_data.referral_code:
-        referral_code = await CodeDAO.find_one_or_none(code=user_data.referral_code)
-        if not referral_code or referral_code.expiration_date < datetime.now():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Недействительный или истекший реферальный код"
-            )
-
-        await UserDAO.update(user.id, code_id=referral_code.id)
-    
-    access_token = create_access_token({'sub': str(user.id)})
+    access_token = create_access_token({'sub': str(user_id)})
     response.set_cookie('user_access_token', access_token, httponly=True)
     return 'Пользователь зарегистрировался'
 
 
-@router.post('/login')
-async def login_user(response: Response, user_data: SUserLogin):
-    user = await authenticate_user(user_data.email, user_data.password)
+@router.post('/register/batch', dependencies=[Depends(rate_limit("register_batch"))])
+async def register_users_batch(
+    users_data: list[SUserRegister],
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
+) -> list[SUserRegisterResult]:
+    if len(users_data) > settings.REGISTER_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"За один запрос можно зарегистрировать не более {settings.REGISTER_BATCH_MAX_SIZE} пользователей"
+        )
+    if not users_data:
+        return []
+
+    # Повтор email в пачке — дубликат первой строки: в INSERT ... SELECT порядок строк не задан,
+    # и ON CONFLICT мог бы оставить не ту, о которой ответ скажет "created"
+    first = {}
+    for index, user_data in enumerate(users_data):
+        first.setdefault(user_data.email, index)
+    candidates = [users_data[index] for index in first.values()]
+
+    # Строки с несуществующим кодом не хешируем и не вставляем
+    unknown = await code_filter.unknown({user_data.referral_code for user_data in candidates if user_data.referral_code})
+    accepted = [user_data for user_data in candidates if user_data.referral_code not in unknown]
+    hashed_passwords = await get_password_hashes([user_data.password for user_data in accepted])
+    created = await UserDAO.register_many(session, [
+        (user_data.email, hashed_password, user_data.referral_code or None)
+        for user_data, hashed_password in zip(accepted, hashed_passwords)
+    ]) if accepted else {}
+
+    codes = {user_data.referral_code for user_data in accepted if user_data.referral_code}
+    active_codes = await CodeDAO.find_active_codes(session, codes) if codes else set()
+
+    results = []
+    for index, user_data in enumerate(users_data):
+        if first[user_data.email] != index:
+            results.append(SUserRegisterResult(email=user_data.email, status="duplicate"))
+        elif user_data.referral_code and user_data.referral_code not in active_codes:
+            results.append(SUserRegisterResult(email=user_data.email, status="invalid_code"))
+        elif user_data.email in created:
+            user_id, _ = created[user_data.email]
+            results.append(SUserRegisterResult(email=user_data.email, status="created", id=user_id))
+        else:
+            results.append(SUserRegisterResult(email=user_data.email, status="duplicate"))
+
+    if created and settings.ENRICHMENT_PROVIDERS:
+        after_commit(session, enricher.wake)
+    bound = {email: code_id for email, (_, code_id) in created.items() if code_id}
+    if bound:
+        after_commit(session, CodeDAO.invalidate_code_by_email, *bound)
+        background_tasks.add_task(invalidate_referral_trees, *set(bound.values()))
+    return results
+
+
+@router.post('/login', dependencies=[Depends(rate_limit("login"))])
+async def login_user(response: Response, user_data: SUserLogin, session: AsyncSession = Depends(get_session)) -> str:
+    user = await authenticate_user(session, user_data.email, user_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный логин или пароль")
     access_token = create_access_token({'sub': str(user.id)})
@@ -82,11 +160,14 @@ async def login_user(response: Response, user_data: SUserLogin):
 
 
 @router.post('/logout')
-async def logout_user(response: Response):
+async def logout_user(request: Request, response: Response) -> str:
+    token = request.cookies.get('user_access_token')
+    if token:
+        await revoke_token(token)
     response.delete_cookie('user_access_token')
     return 'Пользователь вышел из системы'
 
 
 @router.get("/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: SUserPrincipal = Depends(get_current)) -> SUserPrincipal:
     return current_user
@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr
+from typing import Literal, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr
 
 
 class SUserRegister(BaseModel):
@@ -9,4 +9,23 @@ class SUserRegister(BaseModel):
 
 class SUserLogin(BaseModel):
     email: EmailStr
-    password: str
\ No newline at end of file
+    password: str
+
+
+class SUserPrincipal(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    email: str
+    code_id: Optional[int] = None
+
+
+class SAccessToken(BaseModel):
+    access_token: str
+    token_type: str
+
+
+class SUserRegisterResult(BaseModel):
+    email: str
+    status: Literal["created", "duplicate", "invalid_code"]
+    id: Optional[int] = None
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+
+from .config import settings
+
+
+READ_ROLES = ("primary", "replica")
+
+
+class Abandoned(Exception):
+    # Ведущий вызов отменён (клиент ушёл) — ожидающие повторяют запрос сами
+    pass
+
+
+class SingleFlight:
+    # Одинаковые одновременные вызовы в пределах процесса ждут один выполняющийся запрос
+
+    def __init__(self):
+        self._flights: dict[tuple, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: tuple, func, *args, **kwargs):
+        while (future := self._flights.get(key)) is not None:
+            try:
+                result = await asyncio.shield(future)
+            except Abandoned:
+                continue
+            self.coalesced += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        self.executed += 1
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self.abandoned += 1
+            self._fail(future, Abandoned())
+            raise
+        except Exception as exc:
+            self._fail(future, exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+    @staticmethod
+    def _fail(future: asyncio.Future, exc: BaseException):
+        future.set_exception(exc)
+        # Без ожидающих исключение никто не заберёт — не пишем об этом в лог
+        future.exception()
+
+    def forget(self, namespace: str, *args):
+        # Следующие вызовы начнут новый запрос, а не присоединятся к начатому до изменения данных
+        for role in READ_ROLES:
+            self._flights.pop((namespace, role, args, ()), None)
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "in_flight": len(self._flights),
+        }
+
+
+single_flight = SingleFlight()
+
+
+def coalesce(namespace: str):
+    # Для методов DAO только на чтение: (cls, session, *args). Запрос выполняется в сессии
+    # первого вызова, поэтому объединяются только сессии read_session_scope с той же ролью
+    # (primary/replica); в пишущей сессии вызов всегда свой — он видит свою транзакцию
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(cls, session, *args, **kwargs):
+            role = session.info.get("read_role")
+            if not settings.SINGLE_FLIGHT_ENABLED or role is None:
+                return await func(cls, session, *args, **kwargs)
+            key = (namespace, role, args, tuple(sorted(kwargs.items())))
+            return await single_flight.do(key, func, cls, session, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,254 @@
+"""Нагрузочный генератор для основных эндпоинтов.
+
+Гоняет смесь register / login / create-link / get-code-by-email / список рефералов
+с заданной конкурентностью, считает пропускную способность и p50/p95/p99 по
+каждому эндпоинту и сохраняет результат в JSON для сравнения между релизами:
+
+    python -m benchmarks.loadgen --base-url http://127.0.0.1:8000 --concurrency 50 --duration 30 \\
+        --output results/load.json --compare results/previous.json
+
+На время прогона отключите ограничение частоты: RATE_LIMIT_ENABLED=false.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+
+DEFAULT_MIX = {
+    "register": 1,
+    "login": 2,
+    "create_link": 1,
+    "get_code_by_email": 4,
+    "list_referrals": 4,
+}
+
+PASSWORD = "loadgen-password"
+
+
+class LoadState:
+    # Пользователи и коды, созданные за прогон: операции выбирают из них случайно
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.counter = 0
+        self.emails: list[str] = []
+        self.cookies: dict[str, str] = {}
+        self.codes: list[str] = []
+        self.code_ids: list[int] = []
+
+    def new_email(self) -> str:
+        self.counter += 1
+        return f"load-{self.run_id}-{self.counter}@example.com"
+
+    def cookie(self, email: str) -> dict:
+        return {"Cookie": f"user_access_token={self.cookies[email]}"}
+
+
+async def register(client: httpx.AsyncClient, state: LoadState) -> httpx.Response:
+    email = state.new_email()
+    referral_code = random.choice(state.codes) if state.codes else None
+    response = await client.post("/auth/register", json={
+        "email": email, "password": PASSWORD, "referral_code": referral_code,
+    })
+    token = response.cookies.get("user_access_token")
+    if token:
+        state.emails.append(email)
+        state.cookies[email] = token
+    return response
+
+
+async def login(client: httpx.AsyncClient, state: LoadState) -> httpx.Response:
+    email = random.choice(state.emails)
+    response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    token = response.cookies.get("user_access_token")
+    if token:
+        state.cookies[email] = token
+    return response
+
+
+async def create_link(client: httpx.AsyncClient, state: LoadState) -> httpx.Response:
+    email = random.choice(state.emails)
+    response = await client.post("/referral/create-link", json={"expiration_date": 30}, headers=state.cookie(email))
+    if response.status_code == 200:
+        state.codes.append(response.json()["message"])
+    return response
+
+
+async def get_code_by_email(client: httpx.AsyncClient, state: LoadState) -> httpx.Response:
+    return await client.get("/referral/get-code-by-email", params={"email": random.choice(state.emails)})
+
+
+async def list_referrals(client: httpx.AsyncClient, state: LoadState) -> httpx.Response:
+    code_id = random.choice(state.code_ids) if state.code_ids else 1
+    return await client.get(f"/referral/{code_id}", params={"limit": 100})
+
+
+OPERATIONS = {
+    "register": register,
+    "login": login,
+    "create_link": create_link,
+    "get_code_by_email": get_code_by_email,
+    "list_referrals": list_referrals,
+}
+
+
+async def seed(client: httpx.AsyncClient, state: LoadState, users: int):
+    # Несколько рефереров с кодами и их рефералы — чтобы списки и поиск по email были непустыми
+    referrers = max(users // 10, 1)
+    for _ in range(referrers):
+        await register(client, state)
+        await create_link(client, state)
+    for _ in range(users - referrers):
+        await register(client, state)
+
+    for email in random.sample(state.emails, min(len(state.emails), 20)):
+        me = await client.get("/auth/me", headers=state.cookie(email))
+        if me.status_code == 200 and me.json().get("code_id"):
+            state.code_ids.append(me.json()["code_id"])
+
+
+def percentile(latencies: list[float], p: float) -> float:
+    # Ближайший ранг по отсортированному списку
+    if not latencies:
+        return 0.0
+    index = max(int(round(p / 100 * len(latencies) + 0.5)) - 1, 0)
+    return latencies[min(index, len(latencies) - 1)]
+
+
+def summarize(latencies: list[float], statuses: Counter, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    mix: dict[str, int] | None = None,
+    concurrency: int = 10,
+    duration: float | None = None,
+    requests: int | None = None,
+    seed_users: int = 20,
+) -> dict:
+    mix = mix or DEFAULT_MIX
+    state = LoadState()
+    await seed(client, state, seed_users)
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, Counter] = defaultdict(Counter)
+    remaining = requests
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        nonlocal remaining
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, state)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 599
+            latencies[name].append(time.perf_counter() - started)
+            statuses[name][status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {"concurrency": concurrency, "duration": duration, "requests": requests, "mix": mix},
+        "elapsed": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(statuses.values(), Counter()), elapsed),
+        "endpoints": {name: summarize(latencies[name], statuses[name], elapsed) for name in names},
+    }
+
+
+def save_results(result: dict, path: str | Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+def compare(result: dict, previous: dict) -> list[str]:
+    lines = []
+    for name, current in {"total": result["total"], **result["endpoints"]}.items():
+        before = previous["total"] if name == "total" else previous["endpoints"].get(name)
+        if not before:
+            continue
+        lines.append(
+            f"{name:<18} rps {before['rps']:>8} -> {current['rps']:<8} "
+            f"p95 {before['p95_ms']:>8} -> {current['p95_ms']:<8} ms"
+        )
+    return lines
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        return await run_load(client, args.mix, args.concurrency, args.duration, args.requests, args.seed_users)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadgen")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="секунды; игнорируется при --requests")
+    parser.add_argument("--requests", type=int)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="например register=1,login=2,list_referrals=4")
+    parser.add_argument("--seed-users", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="куда сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args(argv)
+    if args.requests:
+        args.duration = None
+
+    result = asyncio.run(run(args))
+    if args.output:
+        save_results(result, args.output)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(result, previous)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
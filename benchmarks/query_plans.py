@@ -0,0 +1,137 @@
+"""Планы горячих запросов до и после индексов из миграции 0003.
+
+В отдельной схеме создаются users и referral_link в состоянии до миграции,
+заполняются через generate_series, затем для каждого запроса выводится
+EXPLAIN (ANALYZE, BUFFERS) без индексов и с ними:
+
+    python -m benchmarks.query_plans --users 2000000 --codes 200000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects import postgresql
+
+from app.database import engine
+from referral_code.dao import active_code_by_email_query, active_code_by_user_query
+
+
+SCHEMA = "query_plans"
+
+SETUP = f"""
+DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+CREATE SCHEMA {SCHEMA};
+CREATE TABLE {SCHEMA}.referral_link (
+    id integer PRIMARY KEY,
+    code varchar(255) UNIQUE,
+    expiration_date timestamp,
+    referrals_count integer NOT NULL DEFAULT 0,
+    owner_id integer
+);
+CREATE INDEX ix_referral_link_owner_id ON {SCHEMA}.referral_link (owner_id);
+CREATE TABLE {SCHEMA}.users (
+    id integer PRIMARY KEY,
+    email varchar(255) UNIQUE,
+    password varchar(255),
+    code_id integer REFERENCES {SCHEMA}.referral_link (id),
+    created_at timestamp DEFAULT timezone('utc', now())
+);
+"""
+
+# Половина кодов истекла, две трети пользователей пришли по коду
+SEED = f"""
+INSERT INTO {SCHEMA}.referral_link (id, code, expiration_date, owner_id)
+SELECT g, 'CODE' || g,
+       timezone('utc', now()) + CASE WHEN g % 2 = 0 THEN interval '30 days' ELSE interval '-30 days' END,
+       g
+FROM generate_series(1, $1::integer) AS g;
+
+INSERT INTO {SCHEMA}.users (id, email, password, code_id)
+SELECT g, 'user' || g || '@example.com', 'x', CASE WHEN g % 3 = 0 THEN NULL ELSE 1 + g % $1::integer END
+FROM generate_series(1, $2::integer) AS g;
+"""
+
+INDEXES = f"""
+CREATE INDEX ix_users_code_id ON {SCHEMA}.users (code_id);
+CREATE UNIQUE INDEX ix_users_email ON {SCHEMA}.users (email) INCLUDE (id, code_id);
+CREATE INDEX ix_referral_link_expiration_date ON {SCHEMA}.referral_link (expiration_date) INCLUDE (id, owner_id);
+"""
+
+def dao_query(stmt) -> str:
+    # Запрос, собранный самим DAO, с таблицами из схемы бенчмарка
+    return str(stmt.compile(
+        dialect=postgresql.dialect(),
+        schema_translate_map={None: SCHEMA},
+        render_schema_translate=True,
+        compile_kwargs={"literal_binds": True},
+    ))
+
+
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Запросы DAO в том виде, в каком их строит SQLAlchemy
+QUERIES = {
+    "referrals page (UserDAO.find_page)": f"""
+        SELECT id, email FROM {SCHEMA}.users WHERE code_id = 42 AND id > 0 ORDER BY id LIMIT 101
+    """,
+    "unbind on delete (CodeDAO.delete)": f"""
+        UPDATE {SCHEMA}.users SET code_id = NULL WHERE code_id = 42 RETURNING id, email
+    """,
+    "active code by user (CodeDAO.find_active_code_by_user)": dao_query(active_code_by_user_query(1000, NOW)),
+    "active code by email (CodeDAO.find_active_code_by_email)": dao_query(
+        active_code_by_email_query("user1000@example.com", NOW)
+    ),
+    "expired batch (SweepDAO.archive_expired)": f"""
+        SELECT id FROM {SCHEMA}.referral_link WHERE expiration_date <= timezone('utc', now()) - interval '29 days'
+        ORDER BY id LIMIT 500 FOR UPDATE SKIP LOCKED
+    """,
+}
+
+
+async def explain(pg, query: str) -> str:
+    # Изменяющие запросы выполняются по-настоящему, поэтому каждый — в откатываемой транзакции
+    tr = pg.transaction()
+    await tr.start()
+    try:
+        rows = await pg.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}")
+    finally:
+        await tr.rollback()
+    return "\n".join(row[0] for row in rows)
+
+
+async def run(args):
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        pg = raw.driver_connection
+
+        started = time.perf_counter()
+        await pg.execute(SETUP)
+        await pg.execute(SEED.split(";")[0], args.codes)
+        await pg.execute(SEED.split(";")[1], args.codes, args.users)
+        await pg.execute(f"ANALYZE {SCHEMA}.users; ANALYZE {SCHEMA}.referral_link")
+        print(f"-- seeded {args.users} users, {args.codes} codes in {time.perf_counter() - started:.1f}s\n")
+
+        before = {name: await explain(pg, query) for name, query in QUERIES.items()}
+        await pg.execute(INDEXES)
+        await pg.execute(f"ANALYZE {SCHEMA}.users; ANALYZE {SCHEMA}.referral_link")
+        after = {name: await explain(pg, query) for name, query in QUERIES.items()}
+
+        for name in QUERIES:
+            print(f"=== {name}\n--- before\n{before[name]}\n--- after\n{after[name]}\n")
+
+        if not args.keep:
+            await pg.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    await engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.query_plans")
+    parser.add_argument("--users", type=int, default=2_000_000)
+    parser.add_argument("--codes", type=int, default=200_000)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему с данными")
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
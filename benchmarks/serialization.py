@@ -0,0 +1,66 @@
+"""Стоимость сериализации списка рефералов в ответ GET /referral/{id}.
+
+Сравнивает прежний путь (валидация моделью + jsonable_encoder + json.dumps),
+путь через response_model с ORJSONResponse и текущий (строки из базы сразу в orjson):
+
+    python -m benchmarks.serialization --sizes 100 1000 10000
+"""
+import argparse
+import json
+import timeit
+from collections import namedtuple
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from referral_code.schemas import ReferralSchema
+
+
+# Строка результата select(User.id, User.email): доступ по атрибутам и _asdict()
+Row = namedtuple("Row", ["id", "email"])
+
+referrals = TypeAdapter(list[ReferralSchema])
+
+
+def legacy(rows):
+    validated = referrals.validate_python([row._asdict() for row in rows])
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False).encode()
+
+
+def response_model_orjson(rows):
+    validated = referrals.validate_python([row._asdict() for row in rows])
+    return orjson.dumps(referrals.dump_python(validated, mode="json"))
+
+
+def direct_orjson(rows):
+    return orjson.dumps([row._asdict() for row in rows])
+
+
+STRATEGIES = {
+    "legacy (json + jsonable_encoder)": legacy,
+    "response_model + ORJSONResponse": response_model_orjson,
+    "rows -> orjson": direct_orjson,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        rows = [Row(i, f"user{i}@example.com") for i in range(size)]
+        expected = orjson.loads(direct_orjson(rows))
+        assert all(orjson.loads(strategy(rows)) == expected for strategy in STRATEGIES.values())
+        number = max(10_000 // size, 1)
+
+        print(f"{size} referrals per response")
+        for name, strategy in STRATEGIES.items():
+            best = min(timeit.repeat(lambda: strategy(rows), number=number, repeat=args.repeat)) / number
+            print(f"  {name:<36} {best * 1000:9.3f} ms  {best / size * 1e6:7.3f} us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""referral counters, ownership, code pool and archive
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 07:31:12.408716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('referral_link', sa.Column('referrals_count', sa.Integer(), server_default='0', nullable=False))
+    # Счётчик для уже существующих привязок
+    op.execute(
+        "UPDATE referral_link r SET referrals_count = "
+        "(SELECT count(*) FROM users u WHERE u.code_id = r.id)"
+    )
+    op.add_column('referral_link', sa.Column('owner_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_referral_link_owner_id'), 'referral_link', ['owner_id'], unique=False)
+    op.create_foreign_key('referral_link_owner_id_fkey', 'referral_link', 'users', ['owner_id'], ['id'], ondelete='SET NULL')
+
+    # Для уже зарегистрированных пользователей дата регистрации неизвестна и остаётся NULL
+    op.add_column('users', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.alter_column('users', 'created_at', server_default=sa.text("timezone('utc', now())"))
+
+    op.create_table('referral_daily_stats',
+    sa.Column('code_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['code_id'], ['referral_link.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('code_id', 'day')
+    )
+
+    op.create_table('referral_code_pool',
+    sa.Column('code', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('code')
+    )
+
+    op.create_table('referral_link_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('code', sa.String(length=255), nullable=True),
+    sa.Column('expiration_date', sa.DateTime(), nullable=True),
+    sa.Column('referrals_count', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_referral_link_archive_code'), 'referral_link_archive', ['code'], unique=False)
+
+    op.create_table('referral_binding_archive',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('code_id', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=True),
+    sa.PrimaryKeyConstraint('user_id', 'code_id')
+    )
+    op.create_index(op.f('ix_referral_binding_archive_code_id'), 'referral_binding_archive', ['code_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_referral_binding_archive_code_id'), table_name='referral_binding_archive')
+    op.drop_table('referral_binding_archive')
+    op.drop_index(op.f('ix_referral_link_archive_code'), table_name='referral_link_archive')
+    op.drop_table('referral_link_archive')
+    op.drop_table('referral_code_pool')
+    op.drop_table('referral_daily_stats')
+    op.drop_column('users', 'created_at')
+    op.drop_constraint('referral_link_owner_id_fkey', 'referral_link', type_='foreignkey')
+    op.drop_index(op.f('ix_referral_link_owner_id'), table_name='referral_link')
+    op.drop_column('referral_link', 'owner_id')
+    op.drop_column('referral_link', 'referrals_count')
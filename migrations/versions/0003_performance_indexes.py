@@ -0,0 +1,34 @@
+"""performance indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 07:25:17.764790
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись в users/referral_link, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_users_code_id'), 'users', ['code_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_users_email', 'users', ['email'], unique=True, postgresql_include=['id', 'code_id'], postgresql_concurrently=True)
+        op.create_index('ix_referral_link_expiration_date', 'referral_link', ['expiration_date'], unique=False, postgresql_include=['id', 'owner_id'], postgresql_concurrently=True)
+    # Уникальность email теперь обеспечивает покрывающий ix_users_email
+    op.drop_constraint('users_email_key', 'users', type_='unique')
+
+
+def downgrade() -> None:
+    op.create_unique_constraint('users_email_key', 'users', ['email'])
+    op.drop_index('ix_referral_link_expiration_date', table_name='referral_link')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_index(op.f('ix_users_code_id'), table_name='users')
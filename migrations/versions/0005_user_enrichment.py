@@ -0,0 +1,39 @@
+"""user enrichment
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 07:46:07.503953
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('enrichment_queue',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=255), nullable=False),
+    sa.Column('available_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index(op.f('ix_enrichment_queue_available_at'), 'enrichment_queue', ['available_at'], unique=False)
+    op.add_column('users', sa.Column('enrichment', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.add_column('users', sa.Column('enriched_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'enriched_at')
+    op.drop_column('users', 'enrichment')
+    op.drop_index(op.f('ix_enrichment_queue_available_at'), table_name='enrichment_queue')
+    op.drop_table('enrichment_queue')
@@ -0,0 +1,32 @@
+"""referral clicks
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 07:48:08.667094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('referral_click_stats',
+    sa.Column('code_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['code_id'], ['referral_link.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('code_id', 'day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('referral_click_stats')
@@ -0,0 +1,28 @@
+"""keep clicks of archived codes
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 08:01:21.639460
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_constraint('referral_click_stats_code_id_fkey', 'referral_click_stats', type_='foreignkey')
+
+
+def downgrade() -> None:
+    # Клики архивных кодов не пройдут проверку внешнего ключа
+    op.execute("DELETE FROM referral_click_stats c WHERE NOT EXISTS (SELECT 1 FROM referral_link r WHERE r.id = c.code_id)")
+    op.create_foreign_key('referral_click_stats_code_id_fkey', 'referral_click_stats', 'referral_link', ['code_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import read_session_scope
+from app.metrics import instrument_dao
+from .models import ReferralLink
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    # Ложноположительные ответы возможны с вероятностью error_rate, ложноотрицательных нет
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного blake2b
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value: str):
+        # Повторное добавление не меняет битов и не увеличивает счётчик
+        added = False
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def false_positive_rate(self) -> float:
+        # Оценка по числу добавленных элементов; растёт, если кодов больше capacity
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+@instrument_dao
+class CodeFilterDAO:
+
+    @classmethod
+    async def stream_codes(cls, session, after: int, batch_size: int):
+        query = (
+            select(ReferralLink.id, ReferralLink.code)
+            .where(ReferralLink.id > after)
+            .order_by(ReferralLink.id)
+            .execution_options(yield_per=batch_size)
+        )
+        result = await session.stream(query)
+        async for row in result:
+            yield row
+
+    @classmethod
+    async def find_existing(cls, session, codes: set[str]) -> set[str]:
+        query = select(ReferralLink.code).where(ReferralLink.code.in_(codes))
+        result = await session.execute(query)
+        return set(result.scalars().all())
+
+
+class CodeFilter:
+    # Все выданные коды в памяти процесса: несуществующий код отклоняется до bcrypt
+    # и записи в базу. Пока фильтр не построен, пропускаем всё.
+
+    def __init__(self):
+        self.filter: BloomFilter | None = None
+        self.watermark = 0
+        self.checks = 0
+        self.rejected = 0
+        self.found_on_miss = 0
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.rebuild_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.filter is not None
+
+    async def unknown(self, codes: set[str]) -> set[str]:
+        # Коды, которых нет в базе. Промах фильтра перепроверяется запросом по индексу:
+        # код мог создать другой воркер после последнего обновления фильтра
+        if not settings.CODE_FILTER_ENABLED or self.filter is None or not codes:
+            return set()
+        self.checks += len(codes)
+        missed = {code for code in codes if code not in self.filter}
+        if not missed:
+            return missed
+        async with read_session_scope(primary=True) as session:
+            found = await CodeFilterDAO.find_existing(session, missed)
+        await self.remember(*found)
+        self.found_on_miss += len(found)
+        self.rejected += len(missed) - len(found)
+        return missed - found
+
+    async def might_exist(self, code: str) -> bool:
+        return not await self.unknown({code})
+
+    async def remember(self, *codes: str):
+        if self.filter is not None:
+            for code in codes:
+                self.filter.add(code)
+
+    async def _load(self, bloom: BloomFilter, after: int) -> int:
+        watermark = after
+        # primary: на реплике может не оказаться только что созданных кодов
+        async with read_session_scope(primary=True) as session:
+            async for row in CodeFilterDAO.stream_codes(session, after, settings.CODE_FILTER_BATCH_SIZE):
+                bloom.add(row.code)
+                watermark = max(watermark, row.id)
+        return watermark
+
+    async def rebuild(self):
+        # Полная перестройка убирает удалённые и архивированные коды
+        started = time.perf_counter()
+        bloom = BloomFilter(settings.CODE_FILTER_CAPACITY, settings.CODE_FILTER_ERROR_RATE)
+        watermark = await self._load(bloom, 0)
+        if bloom.count > bloom.capacity:
+            logger.warning(
+                "Кодов (%d) больше CODE_FILTER_CAPACITY (%d), доля ложных срабатываний %.3f",
+                bloom.count, bloom.capacity, bloom.false_positive_rate(),
+            )
+        self.filter, self.watermark = bloom, watermark
+        self.rebuilds += 1
+        self.rebuild_seconds = time.perf_counter() - started
+
+    async def refresh(self):
+        # Коды, созданные другими воркерами и импортом. Перекрытие по id покрывает транзакции,
+        # закоммиченные не в порядке выдачи id
+        if self.filter is None:
+            return await self.rebuild()
+        after = max(self.watermark - settings.CODE_FILTER_REFRESH_OVERLAP, 0)
+        self.watermark = max(self.watermark, await self._load(self.filter, after))
+        self.refreshes += 1
+
+    async def run(self):
+        rebuilt_at = 0.0
+        while True:
+            try:
+                if time.monotonic() - rebuilt_at >= settings.CODE_FILTER_REBUILD_INTERVAL:
+                    await self.rebuild()
+                    rebuilt_at = time.monotonic()
+                else:
+                    await self.refresh()
+            except Exception:
+                self.errors += 1
+                logger.exception("Не удалось обновить фильтр реферальных кодов")
+            await asyncio.sleep(settings.CODE_FILTER_REFRESH_INTERVAL)
+
+    def stats(self) -> dict:
+        bloom = self.filter
+        return {
+            "ready": self.ready,
+            "codes": bloom.count if bloom else 0,
+            "size_bytes": len(bloom.bits) if bloom else 0,
+            "hashes": bloom.hashes if bloom else 0,
+            "false_positive_rate": bloom.false_positive_rate() if bloom else 0.0,
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "found_on_miss": self.found_on_miss,
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "rebuild_seconds": self.rebuild_seconds,
+        }
+
+
+code_filter = CodeFilter()
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import Date, Integer, column, exists, func, select, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import get_redis
+from app.config import settings
+from app.database import session_scope
+from app.metrics import instrument_dao
+from .models import ReferralClickStats, ReferralLink, ReferralLinkArchive
+
+
+logger = logging.getLogger(__name__)
+
+
+@instrument_dao
+class ClickDAO:
+
+    @classmethod
+    async def upsert(cls, session: AsyncSession, rows: list[tuple[int, date, int]]):
+        # Одна вставка на всю пачку; порядок по ключу — чтобы воркеры не ловили взаимоблокировки.
+        # Клики по кодам, удалённым до сброса, отбрасываются; по перенесённым в архив — сохраняются
+        clicks = values(
+            column("code_id", Integer), column("day", Date), column("count", Integer), name="clicks"
+        ).data(sorted(rows))
+        source = (
+            select(clicks.c.code_id, clicks.c.day, clicks.c.count)
+            .where(
+                exists().where(ReferralLink.id == clicks.c.code_id) |
+                exists().where(ReferralLinkArchive.id == clicks.c.code_id)
+            )
+            .order_by(clicks.c.code_id, clicks.c.day)
+        )
+        query = pg_insert(ReferralClickStats).from_select(["code_id", "day", "count"], source)
+        query = query.on_conflict_do_update(
+            index_elements=[ReferralClickStats.code_id, ReferralClickStats.day],
+            set_={"count": ReferralClickStats.count + query.excluded["count"]},
+        )
+        await session.execute(query)
+
+    @classmethod
+    async def find_daily(cls, session: AsyncSession, code_id: int, days: int):
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+        query = (
+            select(ReferralClickStats.day, ReferralClickStats.count)
+            .where((ReferralClickStats.code_id == code_id) & (ReferralClickStats.day >= since))
+            .order_by(ReferralClickStats.day)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def total(cls, session: AsyncSession, code_id: int) -> int:
+        query = select(func.coalesce(func.sum(ReferralClickStats.count), 0)).where(ReferralClickStats.code_id == code_id)
+        return await session.scalar(query)
+
+
+class MemoryClickBuffer:
+
+    def __init__(self):
+        self._counts: Counter[str] = Counter()
+        self._pending = 0
+
+    async def add(self, key: str, count: int = 1):
+        self._counts[key] += count
+        self._pending += count
+
+    async def drain(self) -> dict[str, int]:
+        counts, self._counts = self._counts, Counter()
+        self._pending = 0
+        return dict(counts)
+
+    async def restore(self, counts: dict[str, int]):
+        self._counts.update(counts)
+        self._pending += sum(counts.values())
+
+    def pending(self) -> int:
+        return self._pending
+
+
+class RedisClickBuffer:
+    # Общий для всех воркеров буфер в hash; при сбросе hash атомарно переименовывается,
+    # так что клики, пришедшие во время сброса, попадают уже в новый
+
+    def __init__(self, namespace: str):
+        self.key = f"{namespace}:pending"
+        self.namespace = namespace
+        # Клики этого воркера с его последнего сброса: общий hash может забрать и другой воркер
+        self._pending = 0
+
+    async def add(self, key: str, count: int = 1):
+        await get_redis().hincrby(self.key, key, count)
+        self._pending += count
+
+    async def drain(self) -> dict[str, int]:
+        redis = get_redis()
+        flushing = f"{self.namespace}:flushing:{uuid.uuid4().hex}"
+        self._pending = 0
+        try:
+            await redis.rename(self.key, flushing)
+        except Exception as exc:
+            # Буфер пуст или его только что забрал другой воркер
+            if "no such key" in str(exc).lower():
+                return {}
+            raise
+        raw = await redis.hgetall(flushing)
+        await redis.delete(flushing)
+        return {key.decode(): int(value) for key, value in raw.items()}
+
+    async def restore(self, counts: dict[str, int]):
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for key, count in counts.items():
+                pipe.hincrby(self.key, key, count)
+            await pipe.execute()
+
+    def pending(self) -> int:
+        return self._pending
+
+
+class ClickTracker:
+    # Клик — инкремент в буфере, без записи в базу. Буфер сбрасывается пачкой upsert раз
+    # в CLICK_FLUSH_INTERVAL секунд или при CLICK_BUFFER_MAX кликах (для Redis — записанных этим
+    # воркером): это и есть окно потерь при падении процесса (для Redis — только клики, не дошедшие до Redis)
+
+    def __init__(self):
+        self.memory = MemoryClickBuffer()
+        self.redis = RedisClickBuffer("clicks")
+        self.redis_down_until = 0.0
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self._wakeup: asyncio.Event | None = None
+
+    def _use_redis(self) -> bool:
+        return settings.CACHE_BACKEND == "redis" and time.monotonic() >= self.redis_down_until
+
+    def _redis_failed(self):
+        logger.warning("Redis недоступен, клики буферизуются в памяти процесса", exc_info=True)
+        self.fallbacks += 1
+        self.redis_down_until = time.monotonic() + settings.RATE_LIMIT_REDIS_RETRY
+
+    async def record(self, code_id: int):
+        key = f"{code_id}:{datetime.now(timezone.utc).date().isoformat()}"
+        self.recorded += 1
+        buffer = self.memory
+        if self._use_redis():
+            try:
+                await self.redis.add(key)
+                buffer = self.redis
+            except Exception:
+                self._redis_failed()
+        if buffer is self.memory:
+            await self.memory.add(key)
+        if buffer.pending() >= settings.CLICK_BUFFER_MAX and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _drain(self) -> dict[str, int]:
+        counts = Counter(await self.memory.drain())
+        if settings.CACHE_BACKEND == "redis":
+            try:
+                counts.update(await self.redis.drain())
+            except Exception:
+                self._redis_failed()
+        return dict(counts)
+
+    async def flush(self) -> int:
+        counts = await self._drain()
+        if not counts:
+            return 0
+
+        rows = []
+        for key, count in counts.items():
+            code_id, day = key.split(":")
+            rows.append((int(code_id), date.fromisoformat(day), count))
+        try:
+            async with session_scope() as session:
+                await ClickDAO.upsert(session, rows)
+        except Exception:
+            # Не теряем пачку: вернём в память и попробуем при следующем сбросе
+            await self.memory.restore(counts)
+            raise
+        self.flushes += 1
+        self.flushed += sum(counts.values())
+        return len(rows)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.CLICK_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                self.errors += 1
+                logger.exception("Не удалось сохранить клики по реферальным ссылкам")
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "pending_memory": self.memory.pending(),
+            "pending_redis": self.redis.pending(),
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+        }
+
+
+click_tracker = ClickTracker()
@@ -1,78 +1,203 @@
 from datetime import datetime, timezone
-from app.database import async_session_maker
+from app.cache import MISSING, build_cache
+from app.config import settings
+from app.database import after_commit
+from app.metrics import instrument_dao
 from app.models import User
-from .models import ReferralLink
-from functools import lru_cache
+from app.principals import invalidate_principal
+from app.singleflight import coalesce, single_flight
+from .bloom import code_filter
+from .models import ReferralClickStats, ReferralLink
+from .tree import TreeDAO, forget_referral_trees
 
 
-from sqlalchemy import delete, select, insert, update
+from sqlalchemy import String, any_, bindparam, delete, exists, select, insert, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
 
+
+code_by_email_cache = build_cache("code_by_email")
+
+
+def _dump_code(code: ReferralLink | None):
+    if code is None:
+        return None
+    return {
+        "id": code.id,
+        "code": code.code,
+        "expiration_date": code.expiration_date.isoformat(),
+    }
+
+
+def _load_code(data: dict | None):
+    if data is None:
+        return None
+    return ReferralLink(
+        id=data["id"],
+        code=data["code"],
+        expiration_date=datetime.fromisoformat(data["expiration_date"]),
+    )
+
+
+def _owned_by_user():
+    # Свой код ищем по owner_id. Привязка users.code_id — только для старых кодов без владельца:
+    # код реферера, по которому пользователь зарегистрировался, ему не принадлежит
+    return (ReferralLink.owner_id == User.id) | (ReferralLink.owner_id.is_(None) & (ReferralLink.id == User.code_id))
+
+
+def active_code_by_user_query(user_id: int, current_time: datetime):
+    return (
+        select(ReferralLink.id, ReferralLink.code)
+        .join(User, _owned_by_user())
+        .where((User.id == user_id) & (ReferralLink.expiration_date > current_time))
+        .order_by(ReferralLink.owner_id.is_(None))
+        .limit(1)
+    )
+
+
+def active_code_by_email_query(email: str, current_time: datetime):
+    return (
+        select(ReferralLink.id, ReferralLink.code, ReferralLink.expiration_date)
+        .join(User, _owned_by_user())
+        .where((User.email == email) & (ReferralLink.expiration_date > current_time))
+        .order_by(ReferralLink.owner_id.is_(None))
+        .limit(1)
+    )
+
+
+def _code_ttl(code, current_time: datetime) -> int:
+    ttl = settings.CACHE_TTL
+    if code:
+        # Запись не должна пережить срок действия кода
+        ttl = min(ttl, int((code.expiration_date - current_time).total_seconds()))
+    return max(ttl, 1)
+
+
+@instrument_dao
 class CodeDAO:
 
     @classmethod
-    async def find_all(cls, **filter_by):
-        async with async_session_maker() as sesion:
-            query = select(User).filter_by(**filter_by)
-            users = await sesion.execute(query)
-            return users.scalars().all()
+    async def find_all(cls, session: AsyncSession, **filter_by):
+        query = select(User).filter_by(**filter_by)
+        users = await session.execute(query)
+        return users.scalars().all()
 
     @classmethod
-    async def find_active_code_by_user(cls, user_id: int):
-        async with async_session_maker() as session:
-            current_time = datetime.now(timezone.utc)
-            current_time = current_time.replace(tzinfo=None)
-
-            query = select(ReferralLink).join(User).where(
-                (User.id == user_id) &
-                (User.code_id == ReferralLink.id) &
-                (ReferralLink.expiration_date > current_time)
-            )
-            result = await session.execute(query)
-            return result.scalar_one_or_none()
+    async def find_active_code_by_user(cls, session: AsyncSession, user_id: int):
+        current_time = datetime.now(timezone.utc)
+        current_time = current_time.replace(tzinfo=None)
+
+        result = await session.execute(active_code_by_user_query(user_id, current_time))
+        return result.one_or_none()
         
     @classmethod
-    async def add(cls, **data):
-        async with async_session_maker() as session:
-            query = insert(ReferralLink).values(**data).returning(ReferralLink)
-            result = await session.execute(query)
-            await session.commit()
-            return result.scalar_one()
+    async def add(cls, session: AsyncSession, **data):
+        query = insert(ReferralLink).values(**data).returning(ReferralLink)
+        result = await session.execute(query)
+        code = result.scalar_one()
+        after_commit(session, code_filter.remember, code.code)
+        return code
     
     @classmethod
-    async def delete(cls, code_id: int) -> bool:
-        async with async_session_maker() as session:
-            stmt = update(User).where(User.code_id == code_id).values(code_id=None)
-            await session.execute(stmt)
-
-            stmt = delete(ReferralLink).where(ReferralLink.id == code_id)
-            result = await session.execute(stmt)
-            await session.commit()
+    async def delete(cls, session: AsyncSession, code_id: int) -> bool:
+        owners = await TreeDAO.find_ancestors(session, [code_id], settings.REFERRAL_TREE_MAX_DEPTH)
+
+        stmt = update(User).where(User.code_id == code_id).values(code_id=None).returning(User.id, User.email)
+        unbound = (await session.execute(stmt)).all()
+
+        # Код по email владельца тоже меняется — его email возвращаем из того же запроса
+        owner_email = select(User.email).where(User.id == ReferralLink.owner_id).scalar_subquery()
+        stmt = delete(ReferralLink).where(ReferralLink.id == code_id).returning(owner_email)
+        removed = (await session.execute(stmt)).scalars().all()
+        # Внешнего ключа у кликов нет (история архивных кодов хранится) — удаляем сами
+        await session.execute(delete(ReferralClickStats).where(ReferralClickStats.code_id == code_id))
+
+        after_commit(session, invalidate_principal, *(user_id for user_id, _ in unbound))
+        after_commit(session, cls.invalidate_code_by_email, *(email for _, email in unbound), *filter(None, removed))
+        after_commit(session, forget_referral_trees, *owners)
+        return bool(removed)
     
     @classmethod
-    @lru_cache(maxsize=30)
-    async def find_active_code_by_email(cls, email: str):
-        async with async_session_maker() as session:
-            user_query = select(User).where(User.email == email)
-            user_result = await session.execute(user_query)
-            user = user_result.scalar_one_or_none()
-
-            if not user:
-                return None
-            
-            current_time = datetime.now(timezone.utc).replace(tzinfo=None)
-
-            code_query = select(ReferralLink).where(
-                (ReferralLink.id == user.code_id) &  
+    @coalesce("code_by_email")
+    async def find_active_code_by_email(cls, session: AsyncSession, email: str):
+        cached = await code_by_email_cache.get(email)
+        if cached is not MISSING:
+            return _load_code(cached)
+
+        current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        result = await session.execute(active_code_by_email_query(email, current_time))
+        code = result.one_or_none()
+
+        data = _dump_code(code)
+        await code_by_email_cache.set(email, data, ttl=_code_ttl(code, current_time))
+        # Тот же тип, что и из кеша: ReferralLink, а не строка результата
+        return _load_code(data)
+
+    @classmethod
+    async def find_active_codes_by_emails(cls, session: AsyncSession, emails: list[str]) -> dict:
+        # Сначала кеш, промахи — одним запросом с = ANY(...); отсутствующие коды тоже кешируются
+        cached = await code_by_email_cache.get_many(emails)
+        codes = {email: _load_code(data) for email, data in cached.items() if data is not MISSING}
+        missing = [email for email in emails if email not in codes]
+        if not missing:
+            return codes
+
+        current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+        # По одному коду на email, свой — раньше старого привязанного
+        query = (
+            select(User.email, ReferralLink.id, ReferralLink.code, ReferralLink.expiration_date)
+            .join(User, _owned_by_user())
+            .where(
+                (User.email == any_(bindparam("emails", missing, type_=ARRAY(String)))) &
                 (ReferralLink.expiration_date > current_time)
             )
+            .distinct(User.email)
+            .order_by(User.email, ReferralLink.owner_id.is_(None))
+        )
+        result = await session.execute(query)
+        found = {row.email: row for row in result}
 
-            code_result = await session.execute(code_query)
-            return code_result.scalar_one_or_none()
+        dumped = {email: _dump_code(found.get(email)) for email in missing}
+        codes.update({email: _load_code(data) for email, data in dumped.items()})
+        await code_by_email_cache.set_many([
+            (email, data, _code_ttl(found.get(email), current_time)) for email, data in dumped.items()
+        ])
+        return codes
+
+    @classmethod
+    async def find_active_codes(cls, session: AsyncSession, codes: set[str]) -> set[str]:
+        current_time = datetime.now(timezone.utc).replace(tzinfo=None)
+        query = select(ReferralLink.code).where(
+            ReferralLink.code.in_(codes) &
+            (ReferralLink.expiration_date > current_time)
+        )
+        result = await session.execute(query)
+        return set(result.scalars().all())
+
+    @classmethod
+    async def invalidate_code_by_email(cls, *emails: str):
+        for email in emails:
+            single_flight.forget("code_by_email", email)
+        await code_by_email_cache.delete(*emails)
 
     
     @classmethod
-    async def find_one_or_none(cls, **filter_by):
-        async with async_session_maker() as sesion:
-            query = select(ReferralLink).filter_by(**filter_by)
-            result = await sesion.execute(query)
-            return result.scalar_one_or_none() 
\ No newline at end of file
+    @coalesce("code_summary")
+    async def find_summary(cls, session: AsyncSession, code_id: int):
+        query = select(ReferralLink.id, ReferralLink.code, ReferralLink.referrals_count).where(ReferralLink.id == code_id)
+        result = await session.execute(query)
+        return result.one_or_none()
+
+    @classmethod
+    @coalesce("code_exists")
+    async def exists(cls, session: AsyncSession, code_id: int) -> bool:
+        query = select(exists().where(ReferralLink.id == code_id))
+        return await session.scalar(query)
+
+    @classmethod
+    @coalesce("code")
+    async def find_one_or_none(cls, session: AsyncSession, **filter_by):
+        query = select(ReferralLink).filter_by(**filter_by)
+        result = await session.execute(query)
+        return result.scalar_one_or_none() 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy import BigInteger, Column, Date, DateTime, ForeignKey, Index, Integer, String, text
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -6,9 +6,58 @@ from app.database import Base
 
 class ReferralLink(Base):
     __tablename__ = "referral_link"
+    __table_args__ = (
+        # Проверки активности (expiration_date > now) и выборка истёкших кодов свипером
+        Index("ix_referral_link_expiration_date", "expiration_date", postgresql_include=["id", "owner_id"]),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String(255), unique=True, index=True)
     expiration_date = Column(DateTime)
+    referrals_count = Column(Integer, nullable=False, default=0, server_default="0")
+    owner_id = Column(Integer, ForeignKey("users.id", name="referral_link_owner_id_fkey", use_alter=True, ondelete="SET NULL"), nullable=True, index=True)
 
-    users = relationship("User", back_populates="code")
+    users = relationship("User", back_populates="code", foreign_keys="User.code_id")
+
+
+class ReferralDailyStats(Base):
+    __tablename__ = "referral_daily_stats"
+
+    code_id = Column(Integer, ForeignKey("referral_link.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ReferralCodePool(Base):
+    __tablename__ = "referral_code_pool"
+
+    code = Column(String(255), primary_key=True)
+
+
+class ReferralLinkArchive(Base):
+    __tablename__ = "referral_link_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    code = Column(String(255), index=True)
+    expiration_date = Column(DateTime)
+    referrals_count = Column(Integer, nullable=False, default=0)
+    owner_id = Column(Integer, nullable=True)
+    archived_at = Column(DateTime, server_default=text("timezone('utc', now())"))
+
+
+class ReferralBindingArchive(Base):
+    __tablename__ = "referral_binding_archive"
+
+    user_id = Column(Integer, primary_key=True)
+    code_id = Column(Integer, primary_key=True, index=True)
+    archived_at = Column(DateTime, server_default=text("timezone('utc', now())"))
+
+
+class ReferralClickStats(Base):
+    # Переходы по ссылке по дням; пишется пачками из буфера, а не на каждый клик.
+    # Без внешнего ключа: история переходов остаётся, когда свипер переносит код в архив
+    __tablename__ = "referral_click_stats"
+
+    code_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
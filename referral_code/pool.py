@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import secrets
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String, column, delete, exists, func, literal, select, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import session_scope
+from app.metrics import instrument_dao
+from .models import ReferralCodePool, ReferralLink, ReferralLinkArchive
+
+
+logger = logging.getLogger(__name__)
+
+
+def generate_code(length: int | None = None, alphabet: str | None = None) -> str:
+    length = length or settings.CODE_LENGTH
+    alphabet = alphabet or settings.CODE_ALPHABET
+    return "".join(secrets.choice(alphabet) for _ in range(length))
+
+
+@instrument_dao
+class CodePoolDAO:
+
+    @classmethod
+    async def size(cls, session: AsyncSession) -> int:
+        return await session.scalar(select(func.count()).select_from(ReferralCodePool))
+
+    @classmethod
+    async def add_unique(cls, session: AsyncSession, codes: list[str]) -> int:
+        # В пул попадают только коды, которых ещё нет ни в пуле, ни среди выданных и архивных
+        rows = values(column("code", String), name="generated").data([(code,) for code in codes])
+        source = select(rows.c.code).where(
+            ~exists().where(ReferralLink.code == rows.c.code) &
+            ~exists().where(ReferralLinkArchive.code == rows.c.code)
+        )
+        query = pg_insert(ReferralCodePool).from_select(["code"], source).on_conflict_do_nothing()
+        result = await session.execute(query)
+        return result.rowcount
+
+    @classmethod
+    async def claim(cls, session: AsyncSession, expiration_date: datetime, owner_id: int | None):
+        # Один запрос: забрать код из пула (SKIP LOCKED) и создать по нему ссылку.
+        # None — пул пуст; строка с id=None — конфликт кода, нужно повторить.
+        next_code = select(ReferralCodePool.code).limit(1).with_for_update(skip_locked=True).scalar_subquery()
+        claimed = (
+            delete(ReferralCodePool)
+            .where(ReferralCodePool.code == next_code)
+            .returning(ReferralCodePool.code)
+            .cte("claimed")
+        )
+        inserted = (
+            pg_insert(ReferralLink)
+            .from_select(
+                ["code", "expiration_date", "owner_id"],
+                select(claimed.c.code, literal(expiration_date, DateTime), literal(owner_id, Integer)),
+            )
+            .on_conflict_do_nothing(index_elements=[ReferralLink.code])
+            .returning(ReferralLink.id, ReferralLink.code)
+            .cte("inserted")
+        )
+        query = select(inserted.c.id, claimed.c.code).select_from(claimed).outerjoin(
+            inserted, inserted.c.code == claimed.c.code
+        )
+        result = await session.execute(query)
+        return result.one_or_none()
+
+    @classmethod
+    async def insert_generated(cls, session: AsyncSession, code: str, expiration_date: datetime, owner_id: int | None):
+        query = (
+            pg_insert(ReferralLink)
+            .values(code=code, expiration_date=expiration_date, owner_id=owner_id)
+            .on_conflict_do_nothing(index_elements=[ReferralLink.code])
+            .returning(ReferralLink.id, ReferralLink.code)
+        )
+        result = await session.execute(query)
+        return result.one_or_none()
+
+
+class CodeAllocationFailed(Exception):
+    pass
+
+
+class CodePool:
+
+    def __init__(self):
+        self.size = None
+        self.claimed = 0
+        self.fallback = 0
+        self.conflicts = 0
+        self.refills = 0
+        self.generated = 0
+        self.refill_errors = 0
+        self._wakeup: asyncio.Event | None = None
+
+    async def allocate(self, session: AsyncSession, expiration_date: datetime, owner_id: int | None):
+        for _ in range(settings.CODE_CLAIM_ATTEMPTS):
+            claimed = await CodePoolDAO.claim(session, expiration_date, owner_id)
+            if claimed is None:
+                self._wake()
+                break
+            if self.size:
+                self.size -= 1
+            if claimed.id is not None:
+                self.claimed += 1
+                return claimed
+            self.conflicts += 1
+
+        # Пул пуст или исчерпан конфликтами — генерируем код на месте
+        for _ in range(settings.CODE_CLAIM_ATTEMPTS):
+            inserted = await CodePoolDAO.insert_generated(session, generate_code(), expiration_date, owner_id)
+            if inserted is not None:
+                self.fallback += 1
+                return inserted
+            self.conflicts += 1
+        raise CodeAllocationFailed()
+
+    async def refill(self) -> int:
+        # Пополняем до целевого размера, когда пул опустился ниже порога
+        async with session_scope() as session:
+            self.size = await CodePoolDAO.size(session)
+        if self.size >= settings.CODE_POOL_LOW_WATERMARK:
+            return 0
+
+        added_total = 0
+        while self.size < settings.CODE_POOL_TARGET_SIZE:
+            batch = min(settings.CODE_POOL_TARGET_SIZE - self.size, settings.CODE_POOL_REFILL_BATCH)
+            async with session_scope() as session:
+                added = await CodePoolDAO.add_unique(session, [generate_code() for _ in range(batch)])
+            if not added:
+                break
+            self.size += added
+            added_total += added
+
+        self.refills += 1
+        self.generated += added_total
+        return added_total
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                self.refill_errors += 1
+                logger.exception("Не удалось пополнить пул реферальных кодов")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.CODE_POOL_REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "target_size": settings.CODE_POOL_TARGET_SIZE,
+            "claimed": self.claimed,
+            "fallback": self.fallback,
+            "conflicts": self.conflicts,
+            "refills": self.refills,
+            "generated": self.generated,
+            "refill_errors": self.refill_errors,
+        }
+
+
+code_pool = CodePool()
@@ -1,14 +1,26 @@
-import random
-import string
 from datetime import datetime, timedelta, timezone
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from .bloom import code_filter
+from .clicks import ClickDAO, click_tracker
 from .dao import CodeDAO
 from app.dao import UserDAO
-from app.dependencies import get_current
-from app.models import User
-from .schemas import SReferralLink, ReferralSchema
+from app.config import settings
+from app.database import after_commit, pin_to_primary
+from app.dependencies import get_current, get_primary_read_session, get_read_session, get_session, get_user_read_session
+from app.schemas import SUserPrincipal
+from .schemas import (
+    SEmailBatch, SMessage, SMyReferralLink, SReferralCodeByEmail, SReferralDailyStats, SReferralLink, SReferralStats,
+    SReferralTree, ReferralSchema,
+)
+from .pool import CodeAllocationFailed, code_pool
+from .stats import StatsDAO
+from .tree import ReferralTreeTooLarge, get_referral_tree
 
 
 router = APIRouter(
@@ -16,21 +28,18 @@ router = APIRouter(
     tags=["Referral"]
 )
 
-def generate_referral_code(length: int = 20) -> str:
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(characters, k=length))
-
-
 @router.post('/create-link', name="Создание реферальной ссылке")
-async def create_referral_code(code_data: SReferralLink, current_user: User = Depends(get_current)):
-    active_code = await CodeDAO.find_active_code_by_user(current_user.id)
+async def create_referral_code(
+    code_data: SReferralLink,
+    current_user: SUserPrincipal = Depends(get_current),
+    session: AsyncSession = Depends(get_session),
+) -> SMessage:
+    active_code = await CodeDAO.find_active_code_by_user(session, current_user.id)
     if active_code:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="У вас уже есть активный реферальный код"
         )
-   
-    unique_code = generate_referral_code()
 
     expiration_date = code_data.expiration_date
 
@@ -44,57 +53,157 @@ async def create_referral_code(code_data: SReferralLink, current_user: User = De
 
     expiration_date = expiration_date.replace(tzinfo=None)
 
-    new_code = await CodeDAO.add(
-        code=unique_code,
-        expiration_date=expiration_date,
-    )
+    try:
+        new_code = await code_pool.allocate(session, expiration_date, owner_id=current_user.id)
+    except CodeAllocationFailed:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Не удалось выделить реферальный код, повторите попытку"
+        )
+    after_commit(session, CodeDAO.invalidate_code_by_email, current_user.email)
+    after_commit(session, pin_to_primary, current_user.id)
+    after_commit(session, code_filter.remember, new_code.code)
 
-    return {"message": new_code.code}
+    return SMessage(message=new_code.code)
 
 
 
 @router.get('/show_my_link', name="Показать мою реферальную ссылку")
-async def show_my_link(current_user: User = Depends(get_current)):
-    active_code = await CodeDAO.find_active_code_by_user(current_user.id)
+async def show_my_link(current_user: SUserPrincipal = Depends(get_current), session: AsyncSession = Depends(get_user_read_session)) -> SMyReferralLink:
+    active_code = await CodeDAO.find_active_code_by_user(session, current_user.id)
     if not active_code:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="У вас нет реферального кода"
         )
-    return {"Ваша реферальная ссылка": active_code.code}
+    return SMyReferralLink(code=active_code.code)
 
 
 @router.delete('/delete-link', name="Удалить реферальную ссылку")
-async def delete_link(current_user: User = Depends(get_current)):
-    active_code = await CodeDAO.find_active_code_by_user(current_user.id)
+async def delete_link(current_user: SUserPrincipal = Depends(get_current), session: AsyncSession = Depends(get_session)) -> SMessage:
+    active_code = await CodeDAO.find_active_code_by_user(session, current_user.id)
     if not active_code:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="У вас нет реферального кода"
         )
-    deleted = await CodeDAO.delete(code_id=active_code.id)
-    return {'message': "Реферальный код успешно удален"}
+    deleted = await CodeDAO.delete(session, code_id=active_code.id)
+    after_commit(session, pin_to_primary, current_user.id)
+    return SMessage(message="Реферальный код успешно удален")
 
 
 @router.get("/get-code-by-email", name="Получения реферального кода по email адресу реферера")
-async def get_referral_code_by_email(email: EmailStr):
-    referral_code = await CodeDAO.find_active_code_by_email(email)
+async def get_referral_code_by_email(email: EmailStr, session: AsyncSession = Depends(get_primary_read_session)) -> SReferralCodeByEmail:
+    referral_code = await CodeDAO.find_active_code_by_email(session, email)
     if not referral_code:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Реферальный код не найден"
         )
-    return {"Реферальный код": referral_code.code}
+    return SReferralCodeByEmail(code=referral_code.code)
+
+@router.post("/codes-by-email", name="Реферальные коды для списка email адресов рефереров")
+async def get_referral_codes_by_emails(
+    batch: SEmailBatch,
+    session: AsyncSession = Depends(get_primary_read_session),
+) -> dict[str, Optional[str]]:
+    if len(batch.emails) > settings.CODES_BY_EMAIL_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"За один запрос можно передать не более {settings.CODES_BY_EMAIL_MAX_SIZE} email"
+        )
 
-@router.get("/{referral_link_id}", name='Получение информации о рефералах по ID реферальной ссылки')
-async def get_referrals(referral_link_id: int) -> list[ReferralSchema]:
-    # Ищем реферальную ссылку по ID
-    referral_link = await CodeDAO.find_one_or_none(id=referral_link_id)
+    emails = list(dict.fromkeys(batch.emails))
+    codes = await CodeDAO.find_active_codes_by_emails(session, emails)
+    # Промахи остаются в ответе со значением null
+    return {email: codes[email].code if codes[email] else None for email in emails}
+
+
+@router.get("/tree/{user_id}", name="Дерево рефералов пользователя на несколько уровней")
+async def get_referral_tree_by_user(
+    user_id: int,
+    depth: int = Query(3, ge=1, le=settings.REFERRAL_TREE_MAX_DEPTH),
+    counts_only: bool = Query(False, description="Только количество рефералов по уровням"),
+    session: AsyncSession = Depends(get_primary_read_session),
+) -> SReferralTree:
+    try:
+        return await get_referral_tree(session, user_id, depth, counts_only)
+    except ReferralTreeTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Дерево слишком большое, запросите меньшую глубину или counts_only=true"
+        )
+
+
+@router.post("/click/{code}", status_code=status.HTTP_204_NO_CONTENT, name="Переход по реферальной ссылке")
+async def track_click(code: str, session: AsyncSession = Depends(get_read_session)):
+    # Клик только увеличивает счётчик в буфере; в базу клики пишутся пачками (ClickTracker)
+    referral_link = await CodeDAO.find_one_or_none(session, code=code) if await code_filter.might_exist(code) else None
+    if not referral_link or referral_link.expiration_date <= datetime.now(timezone.utc).replace(tzinfo=None):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Недействительный или истекший реферальный код"
+        )
+    if settings.CLICK_TRACKING_ENABLED:
+        await click_tracker.record(referral_link.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/{referral_link_id}/stats", name="Статистика рефералов по ID реферальной ссылки")
+async def get_referral_stats(
+    referral_link_id: int,
+    days: int = Query(30, ge=1, le=365),
+    session: AsyncSession = Depends(get_read_session),
+) -> SReferralStats:
+    referral_link = await CodeDAO.find_summary(session, referral_link_id)
     if not referral_link:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Реферальная ссылка не найдена"
         )
 
-    users = await UserDAO.find_all(code_id=referral_link_id)
-    return users
\ No newline at end of file
+    referrals = await StatsDAO.find_daily(session, referral_link_id, days)
+    daily = {day: SReferralDailyStats(day=day, count=count) for day, count in referrals}
+    for day, clicks in await ClickDAO.find_daily(session, referral_link_id, days):
+        daily.setdefault(day, SReferralDailyStats(day=day, count=0)).clicks = clicks
+    clicks = await ClickDAO.total(session, referral_link_id)
+    return SReferralStats(
+        code_id=referral_link.id,
+        code=referral_link.code,
+        total=referral_link.referrals_count,
+        clicks=clicks,
+        conversion_rate=round(referral_link.referrals_count / clicks, 4) if clicks else None,
+        daily=[daily[day] for day in sorted(daily)],
+    )
+
+
+@router.get(
+    "/{referral_link_id}",
+    name='Получение информации о рефералах по ID реферальной ссылки',
+    response_model=list[ReferralSchema],
+)
+async def get_referrals(
+    referral_link_id: int,
+    after: int | None = Query(None, description="Курсор: id последнего реферала предыдущей страницы"),
+    limit: int = Query(settings.REFERRALS_PAGE_SIZE, ge=1, le=settings.REFERRALS_PAGE_MAX_SIZE),
+    stream: bool = Query(False, description="Отдать всех рефералов потоком NDJSON"),
+    session: AsyncSession = Depends(get_read_session),
+) -> Response:
+    # Ищем реферальную ссылку по ID
+    if not await CodeDAO.exists(session, referral_link_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Реферальная ссылка не найдена"
+        )
+
+    if stream:
+        async def referrals_ndjson():
+            async for user in UserDAO.stream_by_code(referral_link_id, settings.REFERRALS_STREAM_BATCH_SIZE):
+                yield orjson.dumps(user._asdict()) + b"\n"
+
+        return StreamingResponse(referrals_ndjson(), media_type="application/x-ndjson")
+
+    users, next_cursor = await UserDAO.find_page(session, referral_link_id, after, limit)
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    # Строки из базы уже в форме ReferralSchema: отдаём через orjson без повторной валидации
+    return ORJSONResponse([user._asdict() for user in users], headers=headers)
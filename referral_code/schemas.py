@@ -1,5 +1,6 @@
-from typing import List
-from pydantic import BaseModel
+from datetime import date
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
 
 
 class SReferralLink(BaseModel):
@@ -7,4 +8,54 @@ class SReferralLink(BaseModel):
 
 class ReferralSchema(BaseModel):
     id: int
-    email: str
\ No newline at end of file
+    email: str
+
+
+class SMessage(BaseModel):
+    message: str
+
+
+class SMyReferralLink(BaseModel):
+    code: str = Field(serialization_alias="Ваша реферальная ссылка")
+
+
+class SReferralCodeByEmail(BaseModel):
+    code: str = Field(serialization_alias="Реферальный код")
+
+
+class SEmailBatch(BaseModel):
+    emails: List[EmailStr]
+
+
+class SReferralDailyStats(BaseModel):
+    day: date
+    count: int
+    clicks: int = 0
+
+
+class SReferralStats(BaseModel):
+    code_id: int
+    code: str
+    total: int
+    clicks: int = 0
+    # Регистрации на переход; None — переходов ещё не было
+    conversion_rate: Optional[float] = None
+    daily: List[SReferralDailyStats]
+
+
+class SReferralTreeNode(BaseModel):
+    id: int
+    email: str
+    referrals: List["SReferralTreeNode"] = []
+
+
+class SReferralLevel(BaseModel):
+    depth: int
+    count: int
+
+
+class SReferralTree(BaseModel):
+    user_id: int
+    depth: int
+    levels: List[SReferralLevel]
+    tree: Optional[List[SReferralTreeNode]] = None
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Date, cast, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import session_scope
+from app.metrics import instrument_dao
+from app.models import User
+from .models import ReferralDailyStats, ReferralLink
+
+
+def referral_counter_ctes(bound):
+    # Data-modifying CTE для счётчиков: подключаются к запросу вставки через add_cte,
+    # чтобы счётчики обновлялись тем же запросом и в той же транзакции.
+    # bound — CTE с колонкой code_id только что привязанных пользователей.
+    per_code = (
+        select(bound.c.code_id, func.count().label("referrals"))
+        .where(bound.c.code_id.is_not(None))
+        .group_by(bound.c.code_id)
+        .cte("per_code")
+    )
+    totals = (
+        update(ReferralLink)
+        .where(ReferralLink.id == per_code.c.code_id)
+        .values(referrals_count=ReferralLink.referrals_count + per_code.c.referrals)
+        .cte("referral_totals")
+    )
+    today = datetime.now(timezone.utc).date()
+    daily = pg_insert(ReferralDailyStats).from_select(
+        ["code_id", "day", "count"],
+        select(per_code.c.code_id, literal(today, Date), per_code.c.referrals),
+    )
+    daily = daily.on_conflict_do_update(
+        index_elements=[ReferralDailyStats.code_id, ReferralDailyStats.day],
+        set_={"count": ReferralDailyStats.count + daily.excluded["count"]},
+    ).cte("referral_daily")
+    return [totals, daily]
+
+
+@instrument_dao
+class StatsDAO:
+
+    @classmethod
+    async def find_daily(cls, session: AsyncSession, code_id: int, days: int):
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+        query = (
+            select(ReferralDailyStats.day, ReferralDailyStats.count)
+            .where((ReferralDailyStats.code_id == code_id) & (ReferralDailyStats.day >= since))
+            .order_by(ReferralDailyStats.day)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def reconcile_batch(cls, session: AsyncSession, code_ids: list[int]):
+        referrals = select(func.count()).where(User.code_id == ReferralLink.id).scalar_subquery()
+        await session.execute(
+            update(ReferralLink).where(ReferralLink.id.in_(code_ids)).values(referrals_count=referrals)
+        )
+
+        await session.execute(delete(ReferralDailyStats).where(ReferralDailyStats.code_id.in_(code_ids)))
+        day = cast(User.created_at, Date)
+        daily = (
+            select(User.code_id, day, func.count())
+            .where(User.code_id.in_(code_ids) & User.created_at.is_not(None))
+            .group_by(User.code_id, day)
+        )
+        await session.execute(
+            pg_insert(ReferralDailyStats).from_select(["code_id", "day", "count"], daily)
+        )
+
+
+async def reconcile(batch_size: int) -> dict:
+    # Пересчёт счётчиков из users.code_id пачками кодов, по транзакции на пачку
+    totals = {"codes": 0, "batches": 0}
+    after = 0
+    while True:
+        async with session_scope() as session:
+            query = select(ReferralLink.id).where(ReferralLink.id > after).order_by(ReferralLink.id).limit(batch_size)
+            code_ids = (await session.execute(query)).scalars().all()
+            if not code_ids:
+                break
+            await StatsDAO.reconcile_batch(session, code_ids)
+
+        after = code_ids[-1]
+        totals["codes"] += len(code_ids)
+        totals["batches"] += 1
+    return totals
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import after_commit, session_scope
+from app.metrics import instrument_dao
+from app.models import User
+from app.principals import invalidate_principal
+from .dao import CodeDAO
+from .models import ReferralBindingArchive, ReferralLink, ReferralLinkArchive
+from .tree import TreeDAO, forget_referral_trees
+
+
+logger = logging.getLogger(__name__)
+
+
+@instrument_dao
+class SweepDAO:
+
+    @classmethod
+    async def archive_expired(cls, session: AsyncSession, before: datetime, limit: int):
+        # Один запрос на пачку: отобрать истёкшие коды (SKIP LOCKED — несколько воркеров
+        # не мешают друг другу), отвязать пользователей и перенести всё в архив
+        expired = (
+            select(ReferralLink.id)
+            .where(ReferralLink.expiration_date <= before)
+            .order_by(ReferralLink.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("expired")
+        )
+        unbound = (
+            update(User)
+            .where(User.code_id == expired.c.id)
+            .values(code_id=None)
+            .returning(User.id.label("user_id"), User.email, expired.c.id.label("code_id"))
+            .cte("unbound")
+        )
+        archived_bindings = (
+            insert(ReferralBindingArchive)
+            .from_select(["user_id", "code_id"], select(unbound.c.user_id, unbound.c.code_id))
+            .cte("archived_bindings")
+        )
+        removed = (
+            delete(ReferralLink)
+            .where(ReferralLink.id == expired.c.id)
+            .returning(
+                ReferralLink.id, ReferralLink.code, ReferralLink.expiration_date,
+                ReferralLink.referrals_count, ReferralLink.owner_id,
+            )
+            .cte("removed")
+        )
+        archived_links = (
+            insert(ReferralLinkArchive)
+            .from_select(
+                ["id", "code", "expiration_date", "referrals_count", "owner_id"],
+                select(removed.c.id, removed.c.code, removed.c.expiration_date, removed.c.referrals_count, removed.c.owner_id),
+            )
+            .cte("archived_links")
+        )
+        query = (
+            select(
+                removed.c.id,
+                removed.c.owner_id,
+                func.array_remove(func.array_agg(unbound.c.user_id), None).label("user_ids"),
+                func.array_remove(func.array_agg(unbound.c.email), None).label("emails"),
+            )
+            .select_from(removed)
+            .outerjoin(unbound, unbound.c.code_id == removed.c.id)
+            .group_by(removed.c.id, removed.c.owner_id)
+            .add_cte(archived_bindings, archived_links)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+
+class Sweeper:
+
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.archived_links = 0
+        self.archived_bindings = 0
+        self.last_run: dict | None = None
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+
+    async def sweep_batch(self, before: datetime, limit: int) -> tuple[int, int]:
+        async with session_scope() as session:
+            rows = await SweepDAO.archive_expired(session, before, limit)
+            user_ids = [user_id for row in rows for user_id in row.user_ids]
+            emails = [email for row in rows for email in row.emails]
+            owners = {row.owner_id for row in rows if row.owner_id is not None}
+            if owners:
+                # Деревья владельцев и их предков потеряли рефералов
+                query = select(User.code_id).where(User.id.in_(owners) & User.code_id.is_not(None))
+                owner_codes = (await session.execute(query)).scalars().all()
+                owners |= await TreeDAO.find_ancestors(session, owner_codes, settings.REFERRAL_TREE_MAX_DEPTH)
+
+            after_commit(session, invalidate_principal, *user_ids)
+            after_commit(session, CodeDAO.invalidate_code_by_email, *emails)
+            after_commit(session, forget_referral_trees, *owners)
+        return len(rows), len(user_ids)
+
+    async def sweep(self, before: datetime | None = None, batch_size: int | None = None) -> dict:
+        before = before or datetime.now(timezone.utc).replace(tzinfo=None)
+        batch_size = batch_size or settings.SWEEPER_BATCH_SIZE
+        started = time.perf_counter()
+        totals = {"links": 0, "bindings": 0, "batches": 0}
+        while True:
+            links, bindings = await self.sweep_batch(before, batch_size)
+            totals["links"] += links
+            totals["bindings"] += bindings
+            if not links:
+                break
+            totals["batches"] += 1
+            if links < batch_size:
+                break
+            await asyncio.sleep(settings.SWEEPER_BATCH_PAUSE)
+
+        totals["seconds"] = round(time.perf_counter() - started, 3)
+        self.runs += 1
+        self.archived_links += totals["links"]
+        self.archived_bindings += totals["bindings"]
+        self.seconds_total += totals["seconds"]
+        self.seconds_max = max(self.seconds_max, totals["seconds"])
+        self.last_run = totals
+        return totals
+
+    async def run(self):
+        while True:
+            try:
+                totals = await self.sweep()
+                if totals["links"]:
+                    logger.info("Архивировано истёкших кодов: %s", totals)
+            except Exception:
+                self.errors += 1
+                logger.exception("Не удалось архивировать истёкшие коды")
+            await asyncio.sleep(settings.SWEEPER_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "archived_links": self.archived_links,
+            "archived_bindings": self.archived_bindings,
+            "seconds_avg": self.seconds_total / self.runs if self.runs else 0.0,
+            "seconds_max": self.seconds_max,
+            "last_run": self.last_run,
+        }
+
+
+sweeper = Sweeper()
@@ -0,0 +1,130 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.cache import MISSING, build_cache
+from app.config import settings
+from app.database import session_scope
+from app.metrics import instrument_dao
+from app.models import User
+from .models import ReferralLink
+
+
+tree_cache = build_cache("referral_tree", ttl=settings.REFERRAL_TREE_CACHE_TTL)
+
+TREE_MODES = ("tree", "counts")
+
+
+class ReferralTreeTooLarge(Exception):
+    pass
+
+
+def _downline(user_id: int, depth: int):
+    # Рефералы уровня N+1 — пользователи, зарегистрированные по кодам рефералов уровня N
+    downline = (
+        select(User.id, User.email, literal(user_id).label("parent_id"), literal(1).label("depth"))
+        .join(ReferralLink, User.code_id == ReferralLink.id)
+        .where(ReferralLink.owner_id == user_id)
+        .cte("downline", recursive=True)
+    )
+    parent = downline.alias("parent")
+    link = aliased(ReferralLink)
+    child = aliased(User)
+    return downline.union_all(
+        select(child.id, child.email, parent.c.id, parent.c.depth + 1)
+        .select_from(parent)
+        .join(link, link.owner_id == parent.c.id)
+        .join(child, child.code_id == link.id)
+        .where(parent.c.depth < depth)
+    )
+
+
+@instrument_dao
+class TreeDAO:
+
+    @classmethod
+    async def find_levels(cls, session: AsyncSession, user_id: int, depth: int):
+        downline = _downline(user_id, depth)
+        query = select(downline.c.depth, func.count()).group_by(downline.c.depth).order_by(downline.c.depth)
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def find_nodes(cls, session: AsyncSession, user_id: int, depth: int, limit: int):
+        downline = _downline(user_id, depth)
+        query = select(downline).order_by(downline.c.depth, downline.c.id).limit(limit)
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def find_ancestors(cls, session: AsyncSession, code_ids: list[int], depth: int) -> set[int]:
+        # Владельцы кодов и их предки вверх по цепочке — чьи деревья меняются
+        ancestors = (
+            select(ReferralLink.owner_id.label("id"), literal(1).label("depth"))
+            .where(ReferralLink.id.in_(code_ids) & ReferralLink.owner_id.is_not(None))
+            .cte("ancestors", recursive=True)
+        )
+        child = ancestors.alias("child")
+        ancestors = ancestors.union_all(
+            select(ReferralLink.owner_id, child.c.depth + 1)
+            .select_from(child)
+            .join(User, User.id == child.c.id)
+            .join(ReferralLink, ReferralLink.id == User.code_id)
+            .where((child.c.depth < depth) & ReferralLink.owner_id.is_not(None))
+        )
+        result = await session.execute(select(ancestors.c.id).distinct())
+        return set(result.scalars().all())
+
+
+def _build(children: dict, parent_id: int) -> list[dict]:
+    return [
+        {"id": node.id, "email": node.email, "referrals": _build(children, node.id)}
+        for node in children[parent_id]
+    ]
+
+
+async def get_referral_tree(session: AsyncSession, user_id: int, depth: int, counts_only: bool) -> dict:
+    key = f"{user_id}:{depth}:{'counts' if counts_only else 'tree'}"
+    cached = await tree_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    if counts_only:
+        levels = await TreeDAO.find_levels(session, user_id, depth)
+        tree = None
+    else:
+        nodes = await TreeDAO.find_nodes(session, user_id, depth, settings.REFERRAL_TREE_MAX_NODES + 1)
+        if len(nodes) > settings.REFERRAL_TREE_MAX_NODES:
+            raise ReferralTreeTooLarge()
+        levels = sorted(Counter(node.depth for node in nodes).items())
+        children = defaultdict(list)
+        for node in nodes:
+            children[node.parent_id].append(node)
+        tree = _build(children, user_id)
+
+    data = {
+        "user_id": user_id,
+        "depth": depth,
+        "levels": [{"depth": level, "count": count} for level, count in levels],
+        "tree": tree,
+    }
+    await tree_cache.set(key, data)
+    return data
+
+
+async def forget_referral_trees(*user_ids: int):
+    await tree_cache.delete(*(
+        f"{user_id}:{depth}:{mode}"
+        for user_id in user_ids
+        for depth in range(1, settings.REFERRAL_TREE_MAX_DEPTH + 1)
+        for mode in TREE_MODES
+    ))
+
+
+async def invalidate_referral_trees(*code_ids: int):
+    # Вызывается в фоне после регистрации по коду: ищет предков и сбрасывает их деревья
+    async with session_scope() as session:
+        ancestors = await TreeDAO.find_ancestors(session, list(code_ids), settings.REFERRAL_TREE_MAX_DEPTH)
+    await forget_referral_trees(*ancestors)
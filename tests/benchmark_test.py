@@ -0,0 +1,30 @@
+import os
+
+import pytest
+from httpx import AsyncClient
+
+from app.config import settings
+from benchmarks.loadgen import DEFAULT_MIX, run_load, save_results
+
+
+pytestmark = [
+    pytest.mark.benchmark,
+    pytest.mark.skipif(not os.getenv("RUN_BENCHMARKS"), reason="замеры запускаются при RUN_BENCHMARKS=1"),
+]
+
+
+@pytest.mark.asyncio
+async def test_endpoint_latency(ac: AsyncClient, monkeypatch, tmp_path):
+    """Тест: смесь запросов к основным эндпоинтам, латентность и пропускная способность в JSON."""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+
+    result = await run_load(
+        ac,
+        DEFAULT_MIX,
+        concurrency=int(os.getenv("BENCHMARK_CONCURRENCY", "10")),
+        requests=int(os.getenv("BENCHMARK_REQUESTS", "200")),
+    )
+    save_results(result, os.getenv("BENCHMARK_OUTPUT") or tmp_path / "benchmark.json")
+
+    assert set(result["endpoints"]) == set(DEFAULT_MIX)
+    assert result["total"]["errors"] == 0
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+
+from app.database import session_scope
+from app.hashing import password_hasher
+from referral_code.bloom import BloomFilter, code_filter
+from referral_code.dao import CodeDAO
+from referral_code.models import ReferralLink
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    codes = [f"CODE{i}" for i in range(1000)]
+    for code in codes:
+        bloom.add(code)
+    count = bloom.count
+    bloom.add(codes[0])
+
+    assert all(code in bloom for code in codes)
+    # Счётчик приблизительный: код, уже «похожий» на добавленные, его не увеличивает
+    assert 980 <= count <= 1000 and bloom.count == count
+    false_positives = sum(f"OTHER{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert bloom.false_positive_rate() == pytest.approx(0.01, abs=0.005)
+
+
+@pytest.mark.asyncio
+async def test_unknown_code_is_rejected_before_hashing(ac: AsyncClient, session, monkeypatch):
+    """Тест: с построенным фильтром несуществующий код отклоняется без bcrypt, новые коды проходят."""
+    session.add(ReferralLink(code="BLOOMCODE", expiration_date=datetime.now() + timedelta(days=1)))
+    await session.commit()
+    monkeypatch.setattr(code_filter, "filter", None)
+    await code_filter.rebuild()
+
+    completed = password_hasher.completed
+    response = await ac.post("/auth/register", json={
+        "email": "bloom-bot@example.com", "password": "secret", "referral_code": "RANDOMBOTCODE",
+    })
+    assert response.status_code == 400
+    assert password_hasher.completed == completed
+    assert code_filter.stats()["rejected"] >= 1
+
+    async with session_scope() as scope:
+        await CodeDAO.add(scope, code="BLOOMCODE2", expiration_date=datetime.now() + timedelta(days=1))
+    # Код другого воркера: в фильтр этого процесса не попал
+    session.add(ReferralLink(code="BLOOMCODE3", expiration_date=datetime.now() + timedelta(days=1)))
+    await session.commit()
+
+    response = await ac.post("/auth/register/batch", json=[
+        {"email": "bloom1@example.com", "password": "secret", "referral_code": "BLOOMCODE"},
+        {"email": "bloom2@example.com", "password": "secret", "referral_code": "BLOOMCODE2"},
+        {"email": "bloom3@example.com", "password": "secret", "referral_code": "RANDOMBOTCODE"},
+        {"email": "bloom4@example.com", "password": "secret", "referral_code": "BLOOMCODE3"},
+    ])
+    assert [item["status"] for item in response.json()] == ["created", "created", "invalid_code", "created"]
+    assert password_hasher.completed == completed + 3
+    assert code_filter.stats()["found_on_miss"] >= 1
+    assert "BLOOMCODE3" in code_filter.filter
@@ -0,0 +1,78 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.cache import MISSING, MemoryCache
+from app.config import Settings
+from app.database import session_scope
+from app.models import User
+from app.principals import TokenDenylist
+from referral_code.dao import CodeDAO, code_by_email_cache
+from referral_code.models import ReferralLink
+
+
+async def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache("test", ttl=60, maxsize=2)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    assert await cache.get("a") == 1
+
+    await cache.set("c", 3)
+
+    assert await cache.get("b") is MISSING
+    assert await cache.get("a") == 1
+    stats = await cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+async def test_revoked_tokens_are_not_evicted(monkeypatch):
+    monkeypatch.setattr("app.config.settings.CACHE_MAXSIZE", 2)
+    denylist = TokenDenylist("test")
+    expire = int(time.time()) + 60
+    for i in range(5):
+        await denylist.add(f"token{i}", expire)
+    await denylist.add("expired", int(time.time()) - 1)
+
+    assert all([await denylist.contains(f"token{i}") for i in range(5)])
+    assert not await denylist.contains("expired")
+    # Истёкшие записи убираются при следующих добавлениях
+    await denylist.add("token5", expire)
+    assert denylist.stats()["size"] == 6
+
+
+def test_several_workers_require_shared_backend():
+    with pytest.raises(ValueError, match="CACHE_BACKEND=redis"):
+        Settings(WORKERS=2, CACHE_BACKEND="memory")
+    assert Settings(WORKERS=2, CACHE_BACKEND="redis").WORKERS == 2
+
+
+async def test_memory_cache_expires_entries():
+    cache = MemoryCache("test", ttl=0, maxsize=10)
+    await cache.set("a", None)
+    assert await cache.get("a") is MISSING
+
+
+async def test_find_active_code_by_email_is_cached_and_invalidated(session):
+    """Тест: повторный поиск кода по email берётся из кеша до инвалидации."""
+    code = ReferralLink(code="CACHECODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(code)
+    await session.commit()
+    session.add(User(email="cache@example.com", password="x", code_id=code.id))
+    await session.commit()
+
+    await code_by_email_cache.clear()
+    async with session_scope() as scoped:
+        first = await CodeDAO.find_active_code_by_email(scoped, "cache@example.com")
+        hits = (await code_by_email_cache.stats())["hits"]
+        second = await CodeDAO.find_active_code_by_email(scoped, "cache@example.com")
+
+    assert first.code == second.code == "CACHECODE"
+    assert (await code_by_email_cache.stats())["hits"] == hits + 1
+
+    async with session_scope() as scoped:
+        await CodeDAO.delete(scoped, code_id=code.id)
+    async with session_scope() as scoped:
+        assert await CodeDAO.find_active_code_by_email(scoped, "cache@example.com") is None
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytest
 import os
 
@@ -28,7 +28,8 @@ async def prepare_database():
 
     async with async_session_maker() as session:
 
-        expiration_date = datetime.strptime("2025-02-20", "%Y-%m-%d")
+        # Относительно текущей даты: фиксированная дата со временем истекала и роняла тесты
+        expiration_date = datetime.now() + timedelta(days=30)
 
         referral_code_1 = ReferralLink(code="TESTCODE1", expiration_date=expiration_date)
         referral_code_2 = ReferralLink(code="TESTCODE2", expiration_date=expiration_date)
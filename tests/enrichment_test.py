@@ -0,0 +1,79 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import session_scope
+from app.enrichment import Enricher, Provider, StubProvider
+from app.models import EnrichmentTask, User
+
+
+class CompanyProvider(Provider):
+    name = "company"
+    scope = "domain"
+
+    def __init__(self, fail: bool = False):
+        super().__init__(concurrency=2)
+        self.fail = fail
+        self.keys: list[str] = []
+
+    async def fetch_one(self, key: str) -> dict:
+        self.keys.append(key)
+        if self.fail:
+            raise ConnectionError("provider down")
+        return {"company": key.split(".")[0]}
+
+
+@pytest.mark.asyncio
+async def test_registered_user_is_enriched_in_background(ac: AsyncClient, monkeypatch):
+    """Тест: регистрация ставит пользователя в очередь, обогащение сохраняется на пользователе."""
+    monkeypatch.setattr(settings, "ENRICHMENT_PROVIDERS", ["stub"])
+
+    response = await ac.post("/auth/register", json={"email": "enrich@gmail.com", "password": "secret"})
+    assert response.status_code == 200
+
+    enricher = Enricher([StubProvider(concurrency=2)])
+    assert await enricher.process_once() == 1
+
+    async with session_scope() as session:
+        user = (await session.execute(select(User.enrichment, User.enriched_at).filter_by(email="enrich@gmail.com"))).one()
+        assert user.enrichment == {"stub": {"domain": "gmail.com", "free_email": True}}
+        assert user.enriched_at is not None
+        assert await session.scalar(select(EnrichmentTask.user_id)) is None
+
+
+@pytest.mark.asyncio
+async def test_provider_calls_are_batched_cached_and_retried(monkeypatch):
+    """Тест: один запрос к провайдеру на домен, повтор из кеша, при ошибке пользователь остаётся в очереди."""
+    monkeypatch.setattr(settings, "ENRICHMENT_MAX_ATTEMPTS", 2)
+    company = CompanyProvider()
+    enricher = Enricher([company])
+
+    enriched = await enricher.enrich(["a@acme.io", "b@acme.io", "c@globex.io"])
+    assert sorted(company.keys) == ["acme.io", "globex.io"]
+    assert enriched["b@acme.io"] == ({"company": {"company": "acme"}}, False)
+
+    await enricher.enrich(["d@acme.io"])
+    assert len(company.keys) == 2
+
+    async with session_scope() as session:
+        user = User(email="retry@initech.io", password="x")
+        session.add(user)
+        await session.flush()
+        session.add(EnrichmentTask(user_id=user.id, email=user.email))
+
+    failing = Enricher([CompanyProvider(fail=True)])
+    assert await failing.process_once() == 1
+    assert failing.stats()["retried"] == 1
+
+    async with session_scope() as session:
+        task = await session.get(EnrichmentTask, user.id)
+        assert task.attempts == 1
+        # Следующая попытка последняя: сохраняем что есть вместе с ошибкой
+        task.available_at = task.available_at.replace(year=2000)
+
+    assert await failing.process_once() == 1
+    async with session_scope() as session:
+        enrichment = await session.scalar(select(User.enrichment).where(User.id == user.id))
+        assert "provider down" in enrichment["company"]["error"]
+        assert await session.get(EnrichmentTask, user.id) is None
@@ -0,0 +1,27 @@
+import asyncio
+
+from app.hashing import HashQueueFull, PasswordHasher
+
+
+async def test_verify_and_update_rehashes_on_rounds_change():
+    old_hasher = PasswordHasher("thread", workers=1, queue_size=1, rounds=4)
+    new_hasher = PasswordHasher("thread", workers=1, queue_size=1, rounds=5)
+    hashed = await old_hasher.hash("secret")
+
+    verified, new_hash = await new_hasher.verify_and_update("secret", hashed)
+    assert verified
+    assert new_hash.startswith("$2b$05$")
+
+    assert await new_hasher.verify_and_update("secret", new_hash) == (True, None)
+    assert await new_hasher.verify_and_update("wrong", new_hash) == (False, None)
+    assert new_hasher.stats()["rehashed"] == 1
+
+
+async def test_hasher_rejects_when_queue_is_full():
+    hasher = PasswordHasher("thread", workers=1, queue_size=1, rounds=4)
+
+    results = await asyncio.gather(*(hasher.hash("secret") for _ in range(3)), return_exceptions=True)
+
+    assert sum(isinstance(result, HashQueueFull) for result in results) == 1
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["queue_depth"] == 0
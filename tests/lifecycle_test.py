@@ -0,0 +1,29 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.config import settings
+from app.lifecycle import lifecycle
+from app.main import create_app
+
+
+@pytest.fixture
+def quiet_lifespan(monkeypatch):
+    # Без фоновых задач: архивация и пул кодов изменили бы данные остальных тестов
+    for name in ("CODE_POOL_ENABLED", "CODE_FILTER_ENABLED", "SWEEPER_ENABLED", "OUTBOX_ENABLED"):
+        monkeypatch.setattr(settings, name, False)
+    monkeypatch.setattr(lifecycle, "ready", False)
+
+
+@pytest.mark.asyncio
+async def test_startup_warms_up_and_reports_timings(quiet_lifespan):
+    """Тест: при старте прогреваются пул, bcrypt, JWT и запросы DAO, время запуска доступно в метриках."""
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        assert lifecycle.ready
+        assert set(lifecycle.warmup) == {"pool", "hashing", "jwt", "statements", "total"}
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/metrics")
+        assert 'lifecycle{stat="warmup_total_seconds"}' in response.text
+        assert 'lifecycle{stat="startup_seconds"}' in response.text
+
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import func, insert, select
+
+from app.database import session_scope
+from app.models import OutboxEvent
+from app.outbox import MemorySink, OutboxDispatcher
+from referral_code.models import ReferralLink
+
+
+class FailingSink(MemorySink):
+
+    async def send(self, events):
+        raise ConnectionError("sink down")
+
+
+async def drain(dispatcher: OutboxDispatcher):
+    while await dispatcher.dispatch_once():
+        pass
+
+
+@pytest.mark.asyncio
+async def test_registration_event_is_delivered(ac: AsyncClient, session):
+    """Тест: регистрация по коду пишет событие в outbox, диспетчер доставляет его и удаляет."""
+    link = ReferralLink(code="OUTBOXCODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+
+    response = await ac.post("/auth/register", json={
+        "email": "outbox@example.com", "password": "password", "referral_code": "OUTBOXCODE",
+    })
+    assert response.status_code == 200
+
+    sink = MemorySink()
+    dispatcher = OutboxDispatcher(sink)
+    await drain(dispatcher)
+
+    events = [event for event in sink.events if event["payload"]["email"] == "outbox@example.com"]
+    assert len(events) == 1
+    assert events[0]["type"] == "referral.registered"
+    assert events[0]["payload"]["code"] == "OUTBOXCODE"
+    assert events[0]["payload"]["code_id"] == link.id
+    assert dispatcher.stats()["delivered"] == len(sink.events)
+
+    async with session_scope() as scope:
+        assert await scope.scalar(select(func.count()).select_from(OutboxEvent)) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_retried_with_backoff():
+    """Тест: при ошибке приёмника событие остаётся в outbox и откладывается, затем доставляется повторно."""
+    await drain(OutboxDispatcher(MemorySink()))
+    async with session_scope() as scope:
+        await scope.execute(insert(OutboxEvent).values(event_type="test", payload={"n": 1}))
+
+    failing = OutboxDispatcher(FailingSink())
+    assert await failing.dispatch_once() == 0
+    assert failing.stats()["failed"] == 1
+
+    async with session_scope() as scope:
+        event = (await scope.execute(select(OutboxEvent))).scalar_one()
+        now = await scope.scalar(select(func.timezone("utc", func.now())))
+        assert event.attempts == 1
+        assert "sink down" in event.last_error
+        assert event.available_at > now
+        # Задержка прошла — событие снова доступно
+        event.available_at = now - timedelta(seconds=1)
+
+    sink = MemorySink()
+    assert await OutboxDispatcher(sink).dispatch_once() == 1
+    assert sink.events[0]["attempt"] == 2
+    assert sink.events[0]["payload"] == {"n": 1}
@@ -0,0 +1,53 @@
+import pytest
+from httpx import AsyncClient
+
+from app.config import settings
+from app.hashing import password_hasher
+from app.ratelimit import MemoryLimiter, RateLimiter
+
+
+async def test_memory_limiter_refills_tokens():
+    limiter = MemoryLimiter(maxsize=10)
+    assert await limiter.hit("key", limit=2, window=60) == 0
+    assert await limiter.hit("key", limit=2, window=60) == 0
+
+    wait = await limiter.hit("key", limit=2, window=60)
+    assert 0 < wait <= 30
+    assert await limiter.hit("key", limit=2, window=60, cost=5) == 60
+
+
+async def test_rate_limiter_falls_back_to_memory(monkeypatch):
+    async def redis_down(*args, **kwargs):
+        raise ConnectionError()
+
+    monkeypatch.setattr(settings, "RATE_LIMIT_BACKEND", "redis")
+    limiter = RateLimiter()
+    monkeypatch.setattr(limiter.redis, "hit", redis_down)
+
+    assert await limiter.hit("key", "1/60") == 0
+    assert await limiter.hit("key", "1/60") > 0
+    assert limiter.stats()["fallbacks"] == 1
+    assert limiter.stats()["redis_available"] is False
+
+
+@pytest.mark.asyncio
+async def test_login_is_limited_before_hashing(ac: AsyncClient, monkeypatch):
+    """Тест: после исчерпания лимита по email логин отклоняется с 429 без вызова bcrypt."""
+    # Существующий пользователь: неверный пароль проверяется bcrypt, пока лимит не исчерпан.
+    # Свой, а не из conftest — счётчик лимита по email переживает тест
+    response = await ac.post("/auth/register", json={"email": "limited@example.com", "password": "secret"})
+    assert response.status_code == 200
+    monkeypatch.setitem(settings.RATE_LIMITS, "login:email", "2/60")
+    payload = {"email": "limited@example.com", "password": "wrong"}
+
+    completed = password_hasher.completed
+    for _ in range(2):
+        response = await ac.post("/auth/login", json=payload)
+        assert response.status_code == 401
+    assert password_hasher.completed == completed + 2
+
+    completed = password_hasher.completed
+    response = await ac.post("/auth/login", json=payload)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert password_hasher.completed == completed
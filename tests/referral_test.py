@@ -0,0 +1,274 @@
+import json
+from datetime import date, datetime, timedelta
+
+from httpx import AsyncClient
+import pytest
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import session_scope
+from app.profiler import profile_queries
+from app.models import User
+from referral_code.clicks import ClickDAO, click_tracker
+from referral_code.dao import code_by_email_cache
+from referral_code.models import ReferralBindingArchive, ReferralClickStats, ReferralLink, ReferralLinkArchive
+from referral_code.pool import CodePool, CodePoolDAO
+from referral_code.stats import reconcile
+from referral_code.sweeper import Sweeper
+
+
+@pytest.fixture(scope="function")
+async def referral_link_with_users(session):
+    link = ReferralLink(code="PAGECODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+    session.add_all([User(email=f"page{i}@example.com", password="x", code_id=link.id) for i in range(3)])
+    await session.commit()
+    return link.id
+
+
+@pytest.mark.asyncio
+async def test_get_referrals_keyset_pagination(ac: AsyncClient, referral_link_with_users: int):
+    """Тест: рефералы отдаются страницами по курсору из заголовка X-Next-Cursor."""
+    first_page = await ac.get(f"/referral/{referral_link_with_users}", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 2
+
+    cursor = first_page.headers["X-Next-Cursor"]
+    second_page = await ac.get(f"/referral/{referral_link_with_users}", params={"limit": 2, "after": cursor})
+    assert [user["email"] for user in second_page.json()] == ["page2@example.com"]
+    assert "X-Next-Cursor" not in second_page.headers
+
+    too_large = await ac.get(f"/referral/{referral_link_with_users}", params={"limit": 100000})
+    assert too_large.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_referrals_stream(ac: AsyncClient):
+    """Тест: в потоковом режиме рефералы приходят построчно в NDJSON."""
+    response = await ac.get("/referral/1", params={"stream": True})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == ["test1@example.com"]
+
+
+@pytest.mark.asyncio
+async def test_referral_stats_are_maintained_and_reconciled(ac: AsyncClient, session):
+    """Тест: регистрация по коду увеличивает счётчики, пересчёт даёт те же значения."""
+    link = ReferralLink(code="STATSCODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+
+    for email in ("stats1@example.com", "stats2@example.com"):
+        response = await ac.post("/auth/register", json={
+            "email": email, "password": "secret", "referral_code": "STATSCODE",
+        })
+        assert response.status_code == 200
+
+    stats = (await ac.get(f"/referral/{link.id}/stats")).json()
+    assert stats["total"] == 2
+    assert [day["count"] for day in stats["daily"]] == [2]
+
+    await reconcile(batch_size=1)
+    assert (await ac.get(f"/referral/{link.id}/stats")).json() == stats
+
+
+@pytest.mark.asyncio
+async def test_clicks_are_buffered_and_flushed(ac: AsyncClient, session):
+    """Тест: переходы копятся в буфере, после сброса видны в статистике вместе с конверсией."""
+    link = ReferralLink(code="CLICKCODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+
+    for _ in range(4):
+        assert (await ac.post("/referral/click/CLICKCODE")).status_code == 204
+    assert (await ac.post("/referral/click/NOSUCHCODE")).status_code == 404
+    response = await ac.post("/auth/register", json={
+        "email": "clicked@example.com", "password": "secret", "referral_code": "CLICKCODE",
+    })
+    assert response.status_code == 200
+
+    assert (await ac.get(f"/referral/{link.id}/stats")).json()["clicks"] == 0
+    assert click_tracker.stats()["pending_memory"] >= 4
+
+    await click_tracker.flush()
+    await ac.post("/referral/click/CLICKCODE")
+    await click_tracker.flush()
+
+    stats = (await ac.get(f"/referral/{link.id}/stats")).json()
+    assert stats["clicks"] == 5
+    assert stats["conversion_rate"] == 0.2
+    assert [(day["count"], day["clicks"]) for day in stats["daily"]] == [(1, 5)]
+
+
+async def register_with_code(ac: AsyncClient, email: str, referral_code: str | None = None) -> tuple[int, str]:
+    response = await ac.post("/auth/register", json={
+        "email": email, "password": "secret", "referral_code": referral_code,
+    })
+    token = response.cookies.get("user_access_token")
+    me = await ac.get("/auth/me", cookies={"user_access_token": token})
+    link = await ac.post("/referral/create-link", json={"expiration_date": 5}, cookies={"user_access_token": token})
+    return me.json()["id"], link.json()["message"]
+
+
+@pytest.mark.asyncio
+async def test_referral_tree_levels_and_invalidation(ac: AsyncClient):
+    """Тест: дерево рефералов считается на несколько уровней и сбрасывается при новой регистрации."""
+    root_id, root_code = await register_with_code(ac, "root@example.com")
+    _, child_code = await register_with_code(ac, "child@example.com", root_code)
+    await register_with_code(ac, "grandchild1@example.com", child_code)
+
+    response = await ac.get(f"/referral/tree/{root_id}", params={"depth": 2})
+    assert response.status_code == 200
+    tree = response.json()
+    assert tree["levels"] == [{"depth": 1, "count": 1}, {"depth": 2, "count": 1}]
+    assert tree["tree"][0]["email"] == "child@example.com"
+    assert tree["tree"][0]["referrals"][0]["email"] == "grandchild1@example.com"
+
+    await register_with_code(ac, "grandchild2@example.com", child_code)
+
+    counts = (await ac.get(f"/referral/tree/{root_id}", params={"depth": 2, "counts_only": True})).json()
+    assert counts["levels"] == [{"depth": 1, "count": 1}, {"depth": 2, "count": 2}]
+    assert counts["tree"] is None
+    tree = (await ac.get(f"/referral/tree/{root_id}", params={"depth": 2})).json()
+    assert tree["levels"][1]["count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_code_pool_refill_and_claim(monkeypatch):
+    """Тест: пул пополняется уникальными кодами, ссылка создаётся из пула."""
+    monkeypatch.setattr(settings, "CODE_POOL_TARGET_SIZE", 5)
+    monkeypatch.setattr(settings, "CODE_POOL_LOW_WATERMARK", 2)
+    monkeypatch.setattr(settings, "CODE_POOL_REFILL_BATCH", 3)
+    pool = CodePool()
+
+    assert await pool.refill() == 5
+    assert await pool.refill() == 0
+
+    async with session_scope() as session:
+        link = await pool.allocate(session, datetime.now() + timedelta(days=1), owner_id=None)
+        assert await CodePoolDAO.size(session) == 4
+
+    assert len(link.code) == settings.CODE_LENGTH
+    assert pool.stats()["claimed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sweeper_archives_expired_codes(session):
+    """Тест: истёкший код и привязки к нему переносятся в архив пачками, история переходов остаётся."""
+    link = ReferralLink(code="EXPIREDCODE", expiration_date=datetime(2024, 1, 1))
+    session.add(link)
+    await session.commit()
+    session.add(User(email="expired@example.com", password="x", code_id=link.id))
+    session.add(ReferralClickStats(code_id=link.id, day=date(2023, 12, 31), count=3))
+    await session.commit()
+
+    sweeper = Sweeper()
+    totals = await sweeper.sweep(before=datetime(2024, 6, 1))
+    assert totals["links"] == 1 and totals["bindings"] == 1
+
+    async with session_scope() as scope:
+        assert await scope.get(ReferralLink, link.id) is None
+        archived = await scope.get(ReferralLinkArchive, link.id)
+        assert archived.code == "EXPIREDCODE"
+        binding = (await scope.execute(select(ReferralBindingArchive).filter_by(code_id=link.id))).scalar_one()
+        user = await scope.get(User, binding.user_id)
+        assert user.code_id is None
+        # Клики, сброшенные из буфера уже после переноса, тоже сохраняются
+        await ClickDAO.upsert(scope, [(link.id, date(2024, 1, 1), 2)])
+        assert await ClickDAO.total(scope, link.id) == 5
+
+    assert (await sweeper.sweep(before=datetime(2024, 6, 1)))["links"] == 0
+    assert sweeper.stats()["runs"] == 2
+
+
+@pytest.mark.asyncio
+async def test_sweeper_batch_size_is_per_call(session):
+    """Тест: размер пачки передаётся в sweep и не меняет настройки."""
+    session.add_all([
+        ReferralLink(code=f"EXPIREDBATCH{i}", expiration_date=datetime(2023, 1, 1)) for i in range(3)
+    ])
+    await session.commit()
+
+    batch_size = settings.SWEEPER_BATCH_SIZE
+    totals = await Sweeper().sweep(before=datetime(2023, 6, 1), batch_size=1)
+    assert totals["links"] == 3 and totals["batches"] == 3
+    assert settings.SWEEPER_BATCH_SIZE == batch_size
+
+
+@pytest.mark.asyncio
+async def test_created_link_belongs_to_its_owner(ac: AsyncClient):
+    """Тест: созданный код виден владельцу, второй создать нельзя, удаление проходит."""
+    response = await ac.post("/auth/register", json={"email": "owner@example.com", "password": "secret"})
+    cookies = {"user_access_token": response.cookies.get("user_access_token")}
+
+    created = await ac.post("/referral/create-link", json={"expiration_date": 5}, cookies=cookies)
+    assert created.status_code == 200
+
+    my_link = await ac.get("/referral/show_my_link", cookies=cookies)
+    assert my_link.status_code == 200
+    assert my_link.json() == {"Ваша реферальная ссылка": created.json()["message"]}
+    by_email = await ac.get("/referral/get-code-by-email", params={"email": "owner@example.com"})
+    assert by_email.json() == {"Реферальный код": created.json()["message"]}
+
+    second = await ac.post("/referral/create-link", json={"expiration_date": 5}, cookies=cookies)
+    assert second.status_code == 400
+    assert second.json()["detail"] == "У вас уже есть активный реферальный код"
+
+    deleted = await ac.delete("/referral/delete-link", cookies=cookies)
+    assert deleted.status_code == 200
+    assert (await ac.get("/referral/get-code-by-email", params={"email": "owner@example.com"})).status_code == 404
+    assert (await ac.get("/referral/show_my_link", cookies=cookies)).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_referral_responses_keep_their_shape(ac: AsyncClient, session):
+    """Тест: типизированные ответы сохраняют прежние ключи и не отдают лишних полей."""
+    response = await ac.post("/auth/register", json={"email": "shape@example.com", "password": "secret"})
+    cookies = {"user_access_token": response.cookies.get("user_access_token")}
+    link = ReferralLink(code="SHAPECODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+    await session.execute(update(User).where(User.email == "shape@example.com").values(code_id=link.id))
+    await session.commit()
+
+    my_link = await ac.get("/referral/show_my_link", cookies=cookies)
+    assert my_link.json() == {"Ваша реферальная ссылка": "SHAPECODE"}
+
+    by_email = await ac.get("/referral/get-code-by-email", params={"email": "shape@example.com"})
+    assert by_email.json() == {"Реферальный код": "SHAPECODE"}
+
+    me = await ac.get("/auth/me", cookies=cookies)
+    assert set(me.json()) == {"id", "email", "code_id"}
+
+
+@pytest.mark.asyncio
+async def test_codes_by_emails_batch(ac: AsyncClient, session):
+    """Тест: коды рефереров для списка email находятся одним запросом, промахи возвращаются как null и кешируются."""
+    owner = User(email="lookup1@example.com", password="x")
+    session.add(owner)
+    await session.commit()
+    link = ReferralLink(code="BATCHLOOKUP", expiration_date=datetime.now() + timedelta(days=1), owner_id=owner.id)
+    session.add(link)
+    await session.commit()
+    # Зарегистрировался по коду lookup1 — это не его код
+    session.add(User(email="lookup2@example.com", password="x", code_id=link.id))
+    await session.commit()
+
+    emails = ["lookup1@example.com", "lookup2@example.com", "nobody@example.com"]
+    with profile_queries() as profile:
+        response = await ac.post("/referral/codes-by-email", json={"emails": emails})
+    assert response.json() == {
+        "lookup1@example.com": "BATCHLOOKUP",
+        "lookup2@example.com": None,
+        "nobody@example.com": None,
+    }
+    assert profile.count == 1
+
+    hits = (await code_by_email_cache.stats())["hits"]
+    with profile_queries() as profile:
+        again = await ac.post("/referral/codes-by-email", json={"emails": emails})
+    assert again.json() == response.json()
+    assert profile.count == 0
+    assert (await code_by_email_cache.stats())["hits"] == hits + 3
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.database import read_session_scope, session_scope
+from app.principals import principal_cache
+from app.profiler import profile_queries
+from app.singleflight import SingleFlight, single_flight
+from referral_code.dao import CodeDAO
+
+
+async def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = 0
+
+    async def lookup(value):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    results = await asyncio.gather(*(flights.do(("lookup", 21), lookup, 21) for _ in range(10)))
+    assert results == [42] * 10
+    assert calls == 1
+    assert flights.stats() == {"executed": 1, "coalesced": 9, "abandoned": 0, "in_flight": 0}
+
+    # Завершённый запрос не кешируется: следующий вызов выполняется заново
+    assert await flights.do(("lookup", 21), lookup, 21) == 42
+    assert calls == 2
+
+
+async def test_errors_are_shared_and_cancelled_leader_is_replaced():
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("db down")
+
+    results = await asyncio.gather(*(flights.do(("key",), failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.stats()["executed"] == 1
+
+    started = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    leader = asyncio.create_task(flights.do(("slow",), slow))
+    await started.wait()
+    follower = asyncio.create_task(flights.do(("slow",), slow))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == "ok"
+    assert flights.stats()["abandoned"] == 1
+
+
+@pytest.mark.asyncio
+async def test_dao_lookups_are_coalesced():
+    """Тест: одновременные одинаковые запросы к DAO выполняют один SQL-запрос."""
+    async def summary():
+        async with read_session_scope() as session:
+            return await CodeDAO.find_summary(session, 1)
+
+    before = single_flight.stats()
+    with profile_queries() as profile:
+        results = await asyncio.gather(*(summary() for _ in range(5)))
+
+    assert len({result for result in results}) == 1
+    assert profile.count == 1
+    after = single_flight.stats()
+    assert after["executed"] - before["executed"] == 1
+    assert after["coalesced"] - before["coalesced"] == 4
+
+
+@pytest.mark.asyncio
+async def test_write_sessions_are_not_coalesced():
+    """Тест: вызовы в пишущих сессиях не присоединяются к чужому запросу."""
+    async def summary():
+        async with session_scope() as session:
+            return await CodeDAO.find_summary(session, 1)
+
+    with profile_queries() as profile:
+        await asyncio.gather(*(summary() for _ in range(3)))
+    assert profile.count == 3
+
+
+@pytest.mark.asyncio
+async def test_principal_lookups_are_coalesced(ac):
+    """Тест: одновременные промахи кеша пользователя читают его из базы одним запросом."""
+    login = await ac.post("/auth/login", json={"email": "test2@example.com", "password": "password2"})
+    cookies = {"user_access_token": login.cookies.get("user_access_token")}
+    await principal_cache.clear()
+
+    before = single_flight.stats()
+    responses = await asyncio.gather(*(ac.get("/auth/me", cookies=cookies) for _ in range(5)))
+
+    assert {response.json()["email"] for response in responses} == {"test2@example.com"}
+    after = single_flight.stats()
+    assert after["executed"] - before["executed"] == 1
+    assert after["coalesced"] - before["coalesced"] == 4
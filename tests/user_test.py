@@ -1,5 +1,15 @@
+from datetime import datetime, timedelta
+
 from httpx import AsyncClient
 import pytest
+from sqlalchemy import select
+
+from app.config import settings
+from app.dao import UserDAO
+from app.database import session_scope
+from app.models import User
+from app.profiler import profile_queries
+from referral_code.models import ReferralLink
 
 
 @pytest.mark.parametrize("email, password, status_code, referral_code, expected_cookie", [
@@ -92,9 +102,11 @@ async def test_create_referral_code_success(
         assert "message" in create_code_response.json()
 
 
+# test3 получил код в test_create_referral_code_success, у test1 — старый код по users.code_id
 @pytest.mark.parametrize("email, password, expected_creation_status", [
-    ('test3@example.com', 'password3', 400),
+    ('test3@example.com', 'password3', 200),
     ('test1@example.com', 'password1', 200),
+    ('test1@example.com', 'password1', 400),
 ])
 @pytest.mark.asyncio
 async def test_delete_referral_code_success(
@@ -179,3 +191,99 @@ async def test_get_referral_code_by_email(ac: AsyncClient):
 
     response_data = referral_code_response.json()
     assert "Реферальный код" in response_data  
+
+
+@pytest.mark.asyncio
+async def test_logout_revokes_token(ac: AsyncClient):
+    """Тест: после выхода токен отзывается, даже если пользователь уже в кеше."""
+    login_response = await ac.post("/auth/login", json={
+        "email": "test2@example.com",
+        "password": "password2",
+    })
+    access_token = login_response.cookies.get("user_access_token")
+
+    for _ in range(2):
+        me_response = await ac.get("/auth/me", cookies={"user_access_token": access_token})
+        assert me_response.status_code == 200
+        assert me_response.json()["email"] == "test2@example.com"
+        assert "password" not in me_response.json()
+
+    await ac.post("/auth/logout", cookies={"user_access_token": access_token})
+
+    me_response = await ac.get("/auth/me", cookies={"user_access_token": access_token})
+    assert me_response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_register_with_invalid_code_does_not_create_user(ac: AsyncClient):
+    """Тест: регистрация с недействительным кодом не оставляет пользователя в базе."""
+    payload = {"email": "atomic@example.com", "password": "secret", "referral_code": "NOSUCHCODE"}
+
+    response = await ac.post("/auth/register", json=payload)
+    assert response.status_code == 400
+
+    response = await ac.post("/auth/register", json={**payload, "referral_code": None})
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_register_users_batch(ac: AsyncClient, session):
+    """Тест: пакетная регистрация возвращает результат по каждому пользователю, из повторов email сохраняется первый."""
+    link = ReferralLink(code="BATCHCODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+
+    response = await ac.post("/auth/register/batch", json=[
+        {"email": "batch1@example.com", "password": "secret", "referral_code": "BATCHCODE"},
+        {"email": "batch1@example.com", "password": "secret"},
+        {"email": "test1@example.com", "password": "secret"},
+        {"email": "batch2@example.com", "password": "secret", "referral_code": "NOSUCHCODE"},
+        {"email": "batch3@example.com", "password": "secret"},
+    ])
+
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()] == [
+        "created", "duplicate", "duplicate", "invalid_code", "created",
+    ]
+    async with session_scope() as scope:
+        stored = await scope.scalar(select(User).where(User.email == "batch1@example.com"))
+    assert stored.code_id == link.id and stored.id == response.json()[0]["id"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(ac: AsyncClient):
+    """Тест: /metrics отдаёт латентность маршрутов, время запросов по DAO и состояние пулов."""
+    await ac.post("/auth/login", json={"email": "test3@example.com", "password": "password3"})
+
+    response = await ac.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="POST",route="/auth/login",status="200"}' in body
+    assert 'db_query_duration_seconds_count{dao="UserDAO.find_credentials",engine="primary",operation="SELECT"}' in body
+    assert 'password_hash_duration_seconds_count{operation="verify_and_update"}' in body
+    assert 'db_pool{engine="primary",stat="checkouts"}' in body
+
+
+@pytest.mark.asyncio
+async def test_query_profiler_flags_budget(ac: AsyncClient, session, monkeypatch, caplog):
+    """Тест: в режиме профилирования считаются SQL-запросы, превышение бюджета помечается."""
+    # Свой код: TESTCODE1 удаляется в test_delete_referral_code_success
+    link = ReferralLink(code="PROFILECODE", expiration_date=datetime.now() + timedelta(days=1))
+    session.add(link)
+    await session.commit()
+    monkeypatch.setattr(settings, "QUERY_PROFILING", True)
+    monkeypatch.setattr(settings, "SLOW_QUERY_THRESHOLD", 0.0)
+    monkeypatch.setitem(settings.QUERY_BUDGETS, "/referral/{referral_link_id}", 1)
+
+    response = await ac.get(f"/referral/{link.id}")
+    assert int(response.headers["X-Query-Count"]) == 2
+    assert response.headers["X-Query-Budget-Exceeded"] == "1"
+    assert "Медленный запрос" in caplog.text
+    assert "Index" in caplog.text or "Scan" in caplog.text
+
+    with profile_queries(budget=5) as profile:
+        async with session_scope() as session:
+            await UserDAO.find_page(session, 1, after=None, limit=10)
+            await UserDAO.find_page(session, 2, after=None, limit=10)
+    assert profile.count == 2 and not profile.over_budget
+    assert profile.statements[0][0] == profile.statements[1][0]